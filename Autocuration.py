@@ -4,48 +4,80 @@
 # artifact flags of ingested influenza sequences.  See the Influenza autocuration SOP for a detailed
 # description of the algorithms and methods for making up this framework.
 
+import io
 import os
+import math
 import re
+import hashlib
 import sys
 import time
 import pandas as pd
 import numpy as np
+import shutil
 import argparse
 import subprocess
-from Bio import SeqIO
+import tempfile
 from datetime import datetime
-from itertools import groupby
-from operator import itemgetter
+from Bio.Align import PairwiseAligner
+from functools import lru_cache, partial
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from Bio.Blast.Applications import NcbiblastnCommandline
-from Bio.Blast import NCBIXML
+
+
+# Byte codes of the regular (ACGT) and indeterminate (N) nucleotides, in both cases
+REGULAR_NUCS = np.frombuffer(b'ACGTacgt', dtype=np.uint8)
+INDETERMINATE_NUCS = np.frombuffer(b'Nn', dtype=np.uint8)
+
+# Allowed ranges of a flag that is not in the lookup table
+NO_RANGES = np.array([], dtype=int)
+
+# Patterns for pulling the accession number out of a fasta header
+ACCESSION_SPLIT = re.compile(r'[^a-zA-Z0-9\s\w-]+')
+HAS_LETTER = re.compile(r'[a-zA-Z]')
+HAS_DIGIT = re.compile(r'[0-9]')
+
+# Local aligner for computing the identity of a query to a known profile without BLAST
+IDENTITY_ALIGNER = PairwiseAligner(mode = 'local', match_score = 1, mismatch_score = -1, open_gap_score = -1, extend_gap_score = -1)
 
 
 # This object should handle the curation of an input suquence, utilizing the profile alignments,
 # lookup table, and boundary file
 class Curation(object):
 
-	# This object expects a SINGLE QUERY nucleotide sequence in fasta at minimum. Optionally, it can also take a 
+	# This object expects a SINGLE QUERY nucleotide sequence in fasta at minimum, as a file path or an open handle
+	# (e.g. io.StringIO of a fasta string, so no query file needs to be written). Optionally, it can also take a 
 	# strain name denoted as [Speicies]_[Segment #]_[Subtype].  The object can also take in a specified boundary 
 	# file, lookup table file, and a directory name specifying the location of all the profile fasta files.  If
 	# those required files are not inputted as arguments, the object navigates to the default location of these
-	# files.
+	# files.  A Blast object already computed for the query (see Curation.batch) can be passed in to skip BLAST.
 	def __init__(self, query, strain_name = None, boundary_file = "profiles/Flu_profile_boundaries_20181012.txt", 
-		lookup_table = "profiles/Flu_profile_lookupTable_20181203.txt", profile_dir = "profiles", output_dir = "outputs"):
+		lookup_table = "profiles/Flu_profile_lookupTable_20181203.txt", profile_dir = "profiles", output_dir = "outputs",
+		blast = None):
 			
+		# Read the query once, then hand the fasta string to BLAST and MUSCLE rather than re-reading the file
+		query_fasta = Blast.read_query(query)
+
 		# Grab accession number and nucleotide sequence string for query sequence in the fasta file
-		accession, sequence = self.get_acc_and_seq(query)
+		accession, sequence = self.get_acc_and_seq(io.StringIO(query_fasta))
 
 		# Get the profile. Only BLAST if strain name not passed to init
 		if strain_name:
 			# Get the appropriate profile for the profile_dir based on the strain name
 			try:
-				profile = [filename for filename in os.listdir(profile_dir) if filename.startswith(strain_name)][0]
+				profiles = self.profile_index(profile_dir)
+				if strain_name in profiles:
+					profile = profiles[strain_name]
+				else:
+					profile = [filename for filename in profiles.values() if filename.startswith(strain_name)][0]
 			except:
 				raise Exception("\nERROR: Invalid profiles directory or strain name\n")
+
+			# Without a BLAST hit there is no identity yet, it is computed below
+			identity = math.nan
 		else:
 			# BLAST query to determine the appropriate profile and strain name
-			b = Blast(query)
+			b = blast if blast else Blast(io.StringIO(query_fasta))
 			profile = b.get_profile()
 			identity = b.get_identity()
 			strain_name = b.get_strain()
@@ -53,14 +85,20 @@ class Curation(object):
 		# Check if BLAST result found profile. If not, abort the rest of the pipeline
 		if profile == "Unknown":
 			self.profile = "Unknown"
-			self.identity = "Unknown"
+			self.identity = math.nan
 			self.strain_name = "Unknown"
 			self.accession = accession
 			return
 
+		# A profile found without a nucleotide identity (a strain name was given, or DIAMOND found the profile
+		# from the translated query) gets its identity in process against the sequences of the profile
+		if math.isnan(identity):
+			profile_seqs = [seq.replace("-", "").replace("~", "") for seq_id, seq in MolSeq.read_fasta(profile_dir+'/'+profile)]
+			identity = self.reidentity(sequence, profile_seqs)
+
 		# Parse boundary and lookup table text files
 		boundary_df = self.parse_boundary_file(strain_name, boundary_file)
-		lookup_df = self.parse_lookup_table(profile, lookup_table)
+		lookup = self.parse_lookup_table(profile, lookup_table)
 
 		# Determine the ambiguity flags, if any
 		ambig_flags = []
@@ -72,16 +110,17 @@ class Curation(object):
 		if identity < 0.80:
 			ambig_flags.append("Excess-Dist")
 
-		# Compute the alignment of the query to the profile using MUSCLE
-		alignment = profile_dir+"/precomputed_alignment.fasta"
-		cmd = './muscle -maxiters 1000 -profile -in1 '+profile_dir+'/'+profile+' -in2 '+query+' -out '+alignment
-		subprocess.call(cmd, shell = True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+		# Compute the alignment of the query to the profile using MUSCLE.  The query is piped in on stdin and the
+		# alignment is read straight from MUSCLE's stdout instead of being written to and re-read from disk
+		cmd = './muscle -maxiters 2 -profile -in1 '+profile_dir+'/'+profile+' -in2 /dev/stdin'
+		alignment = subprocess.run(cmd, shell = True, input = query_fasta, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, 
+			text = True).stdout
 
 		# Initialize InDelSubs object to identify mutations from the alignment
-		muts = InDelSubs(alignment)
+		muts = InDelSubs(io.StringIO(alignment))
 		
 		# Get the Flags
-		del_flags =	muts.deletion_flags(boundary_df, lookup_df)
+		del_flags =	muts.deletion_flags(boundary_df, lookup)
 		ins_flags = muts.insertion_flags(boundary_df)
 		sub_flags = muts.substitution_flags(boundary_df)
 
@@ -101,6 +140,16 @@ class Curation(object):
 		self.strain_name = strain_name
 		self.accession = accession
 
+	# Curate a batch of SINGLE QUERY fasta files (paths or open handles), BLASTing all of them with one blastn
+	# run.  Any other arguments are passed to each Curation object.  Returns a Curation object for each query, in order
+	@classmethod
+	def batch(cls, queries, **kwargs):
+
+		query_fastas = [Blast.read_query(query) for query in queries]
+		blasts = Blast.batch([io.StringIO(query_fasta) for query_fasta in query_fastas])
+
+		return([cls(io.StringIO(query_fasta), blast = b, **kwargs) for query_fasta, b in zip(query_fastas, blasts)])
+
 	# Return a table with all mutation flags occuring in the sequence, otherwise return 'Pass' if no flags
 	# However, if no profile alignment was found in BLAST step, return 'Unknown'
 	def mutation_flags(self):
@@ -138,9 +187,9 @@ class Curation(object):
 			return("Ambig-Seq")
 
 		# Logical ordering of what to return for summary flags
-		if True in [True for flag in self.mut_flags if "CDS" in flag[0]]:
+		if any("CDS" in flag[0] for flag in self.mut_flags):
 			return("Flag-CDS")
-		elif True in [True for flag in self.mut_flags if "NCR" in flag[0] or "CTS" in flag[0]]:
+		elif any("NCR" in flag[0] or "CTS" in flag[0] for flag in self.mut_flags):
 			return("Flag-NCR")	
 		else:
 			return("Pass")
@@ -158,93 +207,107 @@ class Curation(object):
 		if self.mut_flags == []:
 			return
 
+		self.write_table6(self.add_to_table6(self.read_table6(Table6)), Table6)
+
+	# Read Table 6 into a dataframe.  When curating many sequences, read Table 6 once, add each curation to
+	# it with add_to_table6, and write it back once with write_table6 rather than calling update_table6
+	# (which reads and rewrites the whole file) for every sequence
+	@staticmethod
+	def read_table6(Table6 = 'outputs/Table6_Jan2019Release.txt'):
+
 		try:
 			table6 = pd.read_csv(Table6, sep = '\t')
 		except:
 			raise Exception("\nERROR: Invalid table6 directory and/or file\n")
 
+		return(table6)
+
+	# Write a Table 6 dataframe back to the Table 6 file
+	@staticmethod
+	def write_table6(table6, Table6 = 'outputs/Table6_Jan2019Release.txt'):
+
+		table6.to_csv(Table6, sep = '\t', index = False)
+
+	# Add the flags of this curation to a Table 6 dataframe, returning the updated dataframe
+	def add_to_table6(self, table6):
+
+		# Nothing to add without a profile or flags
+		if self.profile == "Unknown" or self.mut_flags == []:
+			return(table6)
+
 		# Revert STATUS_THIS_MONTH to Unchanged for those that were updated last month
 		# Revert CURRENT_MONTH_INCREASE count to zero if new month approached
 		# Update PAST_MONTH_INCREASE count to the value of CURRENT_MONTH_INCREASE
 		today = datetime.today()
 		current_month = datetime.today().replace(day=1)
 		table6['LAST_UPDATED'] = pd.to_datetime(table6['LAST_UPDATED'], errors='coerce').dt.floor('d')
-		past_months = table6[(table6['LAST_UPDATED'] < current_month) & (table6['STATUS_THIS_MONTH'] != "Unchanged")]
-		for ind in past_months.index:
-			table6.at[ind, 'STATUS_THIS_MONTH'] = "Unchanged"
-			table6.at[ind, 'PAST_MONTH_INCREASE'] = int(table6['CURRENT_MONTH_INCREASE'][ind])
-			table6.at[ind, 'CURRENT_MONTH_INCREASE'] = 0
-
-		# Loop through all detected flags
-		for flag in self.mut_flags:
-			if (flag[0] == "5'NCR-ext") or (flag[0] == "3'NCR-ext"):
-				table6_profile = table6[(table6['PROFILE_NAME'] == self.profile) & (table6['FLU_SUBTYPE'] == self.strain_name) & 
-				(table6['AUTO_ALIGNMENT_ISSUE'] == flag[0])]
-				# Check if flag returns something already in the table
-				if not table6_profile.empty:
-					index = table6_profile.index[0]
-					status = str(table6['STATUS_THIS_MONTH'][index])
-					acc_list = set(str(table6['ACCESSION_LIST'][index]).split(","))
-					if self.accession not in acc_list:
-						acc_list.add(self.accession)
-						acc_list = list(acc_list)
-						acc_list.sort()
-						acc_list = ",".join(acc_list)
-
-						if status == "Unchanged":
-							table6.at[index, 'STATUS_THIS_MONTH'] = str("Updated")
-							table6.at[index, 'LAST_UPDATED'] = today
-						table6.at[index, 'ACCESSION_TOTAL'] = int(table6['ACCESSION_TOTAL'][index])+1
-						table6.at[index, 'CURRENT_MONTH_INCREASE'] = int(table6['CURRENT_MONTH_INCREASE'][index])+1
-						table6.at[index, 'ACCESSION_LIST'] = str(acc_list)
-
-				else:
-					table6_profile = pd.DataFrame({'PROFILE_NAME': [self.profile], 'STATUS_THIS_MONTH': ["New"], 'LAST_UPDATED': [today], 
-						'FLU_SUBTYPE': [self.strain_name], 'AUTO_ALIGNMENT_ISSUE': [flag[0]], 'POS_PROFILE': [""], 'MUTATION_SUM': [""], 
-						'ACCESSION_TOTAL': [1], 'CURRENT_MONTH_INCREASE': [1], 'ACCESSION_LIST': [self.accession]})
-					table6 = pd.concat([table6, table6_profile], axis = 0)
-
-			else:
-				table6_profile = table6[(table6['PROFILE_NAME'] == self.profile) & (table6['FLU_SUBTYPE'] == self.strain_name) & 
-				(table6['AUTO_ALIGNMENT_ISSUE'] == flag[0]) & (table6['POS_PROFILE'] == flag[1])]
-				if not table6_profile.empty:
-					index = table6_profile.index[0]
-					status = str(table6['STATUS_THIS_MONTH'][index])
-					acc_list = set(str(table6['ACCESSION_LIST'][index]).split(","))
-					if self.accession not in acc_list:
-						acc_list.add(self.accession)
-						acc_list = list(acc_list)
-						acc_list.sort()
-						acc_list = ",".join(acc_list)
-
-						if status == "Unchanged":
-							table6.at[index, 'STATUS_THIS_MONTH'] = str("Updated")
-							table6.at[index, 'LAST_UPDATED'] = today
-						table6.at[index, 'ACCESSION_TOTAL'] = int(table6['ACCESSION_TOTAL'][index])+1
-						table6.at[index, 'CURRENT_MONTH_INCREASE'] = int(table6['CURRENT_MONTH_INCREASE'][index])+1
-						table6.at[index, 'ACCESSION_LIST'] = str(acc_list)
-
-						if flag[0] == "5'CTS-mut" or flag[0] == "3'CTS-mut":
-							mut_sum = str(table6['MUTATION_SUM'][index])
-							mut_sum = dict(item.split(":") for item in mut_sum.split(","))
-							if mut_sum.get(flag[3]):
-								mut_sum[flag[3]] = str(int(mut_sum[flag[3]])+1)
-							else:
-								mut_sum[flag[3]] = str(1)
-							mut_sum = ",".join([key+':'+val for key, val in mut_sum.items()])
-							table6.at[index, 'MUTATION_SUM'] = mut_sum
-				
-				else:
-					mut_sum = ""
-					if flag[0] == "5'CTS-mut" or flag[0] == "3'CTS-mut":
-						mut_sum = flag[3]+':'+str(1)
-					table6_profile = pd.DataFrame({'PROFILE_NAME': [self.profile], 'STATUS_THIS_MONTH': ["New"], 'LAST_UPDATED': [today], 
-						'FLU_SUBTYPE': [self.strain_name], 'AUTO_ALIGNMENT_ISSUE': [flag[0]], 'POS_PROFILE': [flag[1]], 'MUTATION_SUM': [mut_sum], 
-						'ACCESSION_TOTAL': [1], 'CURRENT_MONTH_INCREASE': [1], 'ACCESSION_LIST': [self.accession]})
-					table6 = pd.concat([table6, table6_profile], axis = 0)
+		past_months = (table6['LAST_UPDATED'] < current_month) & (table6['STATUS_THIS_MONTH'] != "Unchanged")
+		table6.loc[past_months, 'PAST_MONTH_INCREASE'] = table6.loc[past_months, 'CURRENT_MONTH_INCREASE'].astype(int)
+		table6.loc[past_months, 'CURRENT_MONTH_INCREASE'] = 0
+		table6.loc[past_months, 'STATUS_THIS_MONTH'] = "Unchanged"
+
+		# Key each Table 6 entry on profile, subtype, flag, and profile position. The NCR extension flags
+		# are matched regardless of profile position, so their position key is left blank.  Only the first
+		# entry for a key is ever updated
+		key_cols = ['PROFILE_NAME', 'FLU_SUBTYPE', 'AUTO_ALIGNMENT_ISSUE', 'POS_PROFILE']
+		ext_flags = ["5'NCR-ext", "3'NCR-ext"]
+		cts_flags = ["5'CTS-mut", "3'CTS-mut"]
+
+		table6_keys = table6[key_cols].astype(str)
+		table6_keys.loc[table6_keys['AUTO_ALIGNMENT_ISSUE'].isin(ext_flags), 'POS_PROFILE'] = ""
+		table6_keys['ROW'] = table6.index
+		table6_keys = table6_keys.drop_duplicates(subset = key_cols, keep = 'first')
+
+		# Build the same keys for the detected flags and merge them against Table 6 to find the
+		# entries that already exist (hits) and the ones that need to be added (misses)
+		flags = pd.DataFrame(self.mut_flags, columns = ['Flag', 'Profile Position', 'Query Position', 'Variant', 'Length'])
+		flags = pd.DataFrame({'PROFILE_NAME': self.profile, 'FLU_SUBTYPE': self.strain_name, 'AUTO_ALIGNMENT_ISSUE': flags['Flag'],
+			'POS_PROFILE': flags['Profile Position'].where(~flags['Flag'].isin(ext_flags), ""), 'VARIANT': flags['Variant']})
+		flags = flags.drop_duplicates(subset = key_cols, keep = 'first')
+		flags = flags.merge(table6_keys, how = 'left', on = key_cols)
+		hits = flags[flags['ROW'].notna()]
+		misses = flags[flags['ROW'].isna()]
+
+		# Update the existing entries, parsing the accession list only for those rows, and skipping
+		# entries that already include this accession
+		rows = hits['ROW'].astype(int).to_numpy()
+		acc_lists = [set(accs.split(",")) for accs in table6.loc[rows, 'ACCESSION_LIST'].astype(str)]
+		new_acc = np.array([self.accession not in accs for accs in acc_lists], dtype = bool)
+		variants = hits['VARIANT'].to_numpy()[new_acc]
+		cts = hits['AUTO_ALIGNMENT_ISSUE'].isin(cts_flags).to_numpy()[new_acc]
+		acc_lists = [accs for accs, new in zip(acc_lists, new_acc) if new]
+		rows = rows[new_acc]
+
+		if len(rows) > 0:
+			unchanged = rows[(table6.loc[rows, 'STATUS_THIS_MONTH'].astype(str) == "Unchanged").to_numpy()]
+			table6.loc[unchanged, 'STATUS_THIS_MONTH'] = "Updated"
+			table6.loc[unchanged, 'LAST_UPDATED'] = today
+			table6.loc[rows, 'ACCESSION_TOTAL'] = table6.loc[rows, 'ACCESSION_TOTAL'].astype(int) + 1
+			table6.loc[rows, 'CURRENT_MONTH_INCREASE'] = table6.loc[rows, 'CURRENT_MONTH_INCREASE'].astype(int) + 1
+			table6.loc[rows, 'ACCESSION_LIST'] = [",".join(sorted(accs | {self.accession})) for accs in acc_lists]
+
+		# Add the CTS substitution to the mutation summary of the updated CTS-mut entries.  The summaries
+		# are parsed into Counters, incremented, and written back with a single assignment
+		cts_rows = rows[cts]
+		if len(cts_rows) > 0:
+			mut_sums = [Counter({key: int(val) for key, val in (item.split(":") for item in mut_sum.split(","))})
+				for mut_sum in table6.loc[cts_rows, 'MUTATION_SUM'].astype(str)]
+			for mut_sum, variant in zip(mut_sums, variants[cts]):
+				mut_sum[variant] += 1
+			table6.loc[cts_rows, 'MUTATION_SUM'] = [",".join([key+':'+str(val) for key, val in mut_sum.items()]) for mut_sum in mut_sums]
+
+		# Add all of the new entries with a single concat
+		if not misses.empty:
+			mut_sum = np.where(misses['AUTO_ALIGNMENT_ISSUE'].isin(cts_flags), misses['VARIANT']+':'+str(1), "")
+			table6_profile = pd.DataFrame({'PROFILE_NAME': self.profile, 'STATUS_THIS_MONTH': "New", 'LAST_UPDATED': today, 
+				'FLU_SUBTYPE': self.strain_name, 'AUTO_ALIGNMENT_ISSUE': misses['AUTO_ALIGNMENT_ISSUE'].to_numpy(), 
+				'POS_PROFILE': misses['POS_PROFILE'].to_numpy(), 'MUTATION_SUM': mut_sum, 
+				'ACCESSION_TOTAL': 1, 'CURRENT_MONTH_INCREASE': 1, 'ACCESSION_LIST': self.accession})
+			table6 = pd.concat([table6, table6_profile], axis = 0, ignore_index = True)
 
 		table6 = table6.sort_values(by = ['PROFILE_NAME', 'ACCESSION_TOTAL'], ascending = [True, False]).reset_index(drop=True)
-		table6.to_csv(Table6, sep = '\t', index = False)
+
+		return(table6)
 
 
 	# Return just a table of the deletion flags, if any
@@ -288,11 +351,11 @@ class Curation(object):
 
 		return(self.profile)
 
-	# Return the percent identity match to the top hit from the BLAST result
+	# Return the percent identity match to the top hit from the BLAST result, or 'Unknown' if there was no hit
 	def get_identity(self):
 
-		if self.identity == "Unknown":
-			return(self.identity)
+		if math.isnan(self.identity):
+			return("Unknown")
 		else:
 			return(round(self.identity, 3))
 	
@@ -310,39 +373,78 @@ class Curation(object):
 	@staticmethod
 	def get_acc_and_seq(query):
 		
-		for seq_record in SeqIO.parse(query, 'fasta'):
-			metadata = str(seq_record.id)
-			sequence = str(seq_record.seq).strip()
+		for seq_id, seq in MolSeq.read_fasta(query):
+			metadata = seq_id
+			sequence = seq.strip()
 		
-		acc = re.split(r'[^a-zA-Z0-9\s\w-]+', metadata)
-		if re.search(r'[a-zA-Z]+', acc[0]) and re.search(r'[0-9]+', acc[0]):
+		acc = ACCESSION_SPLIT.split(metadata)
+		if HAS_LETTER.search(acc[0]) and HAS_DIGIT.search(acc[0]):
 			accession = acc[0]
 		else:
 			accession = acc[1]
 
 		return(accession, sequence)
 
-	# Meant for parsing the boundary file to know the CTS, NCR, and CDS start and end regions of the profile
+	# Identity of the sequence to the closest of the reference sequences, from an in-process local alignment
+	# (identities over alignment length) rather than a BLAST run.  The closest reference is the one with
+	# the best alignment score.  Sequences are compared in upper case, and a query with no local alignment
+	# scoring above 0 has an identity of 0
+	@staticmethod
+	def reidentity(sequence, reference_seqs):
+
+		sequence = sequence.upper()
+		scores = {}
+		for reference_seq in reference_seqs:
+			reference_seq = reference_seq.upper()
+			if reference_seq not in scores:
+				scores[reference_seq] = IDENTITY_ALIGNER.score(sequence, reference_seq)
+
+		reference_seq = max(scores, key = scores.get, default = None)
+		if reference_seq is None or scores[reference_seq] <= 0:
+			return(0.0)
+		alignment = IDENTITY_ALIGNER.align(sequence, reference_seq)[0]
+
+		return(alignment.counts().identities/alignment.length)
+
+	# Map the strain name of each profile in the profile directory to its file name, [strain]_[date].afa.
+	# The index is built from a single listing, cached for the life of the process, and only rebuilt when
+	# the directory's modification time changes
+	@staticmethod
+	def profile_index(profile_dir):
+
+		return(Curation.profile_index_cached(profile_dir, os.path.getmtime(profile_dir)))
+
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def profile_index_cached(profile_dir, mtime):
+
+		profiles = {}
+		for filename in sorted(os.listdir(profile_dir)):
+			profiles.setdefault(filename.rpartition("_")[0], filename)
+
+		return(profiles)
+
+	# Meant for parsing the boundary file to know the CTS, NCR, and CDS start and end regions of the profile.
+	# Parsed boundaries are cached per strain and boundary file, and re-parsed only if the file is modified
 	@staticmethod
 	def parse_boundary_file(strain_name, boundary_file):
 
 		try:
-			boundary_types = open(boundary_file, 'r').readlines()
+			mtime = os.path.getmtime(boundary_file)
 		except:
 			raise Exception("\nERROR: Invalid boundary_file directory and/or file\n")
-		boundary = ""
-		for line in boundary_types:	
-			if (line.startswith(strain_name)):
-				boundary = line
-				break
 
-		boundary = boundary.split("|")
-		boundary.pop(0)
-		boundaries = {}
-		for coord in boundary:
-			feat = coord.split("=")[0]
-			pos = int(coord.split("=")[1])
-			boundaries[feat] = pos
+		return(Curation.parse_boundary_file_cached(strain_name, boundary_file, mtime))
+
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def parse_boundary_file_cached(strain_name, boundary_file, mtime):
+
+		# Boundaries of the first strain that starts with (normally is) the strain name
+		strain_boundaries = Curation.read_boundary_file(boundary_file, mtime)
+		boundaries = strain_boundaries.get(strain_name)
+		if boundaries is None:
+			boundaries = next((strain_boundaries[strain] for strain in strain_boundaries if strain.startswith(strain_name)), {})
 
 		boundary_df = pd.DataFrame({"Region": ["CTS5", "NCR5", "CDS", "NCR3", "CTS3"],
 			"Start": [boundaries['START'], boundaries['CTS5']+1, boundaries['ATG'], boundaries['STOP']+1, boundaries['CTS3']],
@@ -350,16 +452,55 @@ class Curation(object):
 
 		return(boundary_df)
 
+	# Read the whole boundary file once into a dictionary of the feature positions of each strain,
+	# {strain: {'START': x, 'CTS5': y, ...}}, in file order
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def read_boundary_file(boundary_file, mtime):
+
+		try:
+			boundary_types = open(boundary_file, 'r').readlines()
+		except:
+			raise Exception("\nERROR: Invalid boundary_file directory and/or file\n")
+		strain_boundaries = {}
+		for line in boundary_types:
+			if line.startswith("#") or "|" not in line:
+				continue
+			boundary = line.split("|")
+			strain = boundary.pop(0)
+			if strain in strain_boundaries:
+				continue
+			boundaries = {}
+			for coord in boundary:
+				feat = coord.split("=")[0]
+				pos = int(coord.split("=")[1])
+				boundaries[feat] = pos
+			strain_boundaries[strain] = boundaries
+
+		return(strain_boundaries)
+
 	# Meant to parse the lookup table so that we can use information for a specific strain.
+	# Parsed entries are cached per profile and lookup table, and re-parsed only if the file is modified
 	@staticmethod
 	def parse_lookup_table(profile, lookup_table):
 
+		try:
+			mtime = os.path.getmtime(lookup_table)
+		except:
+			raise Exception("\nERROR: Invalid lookup_table directory and/or file\n")
+
+		return(Curation.parse_lookup_table_cached(profile, lookup_table, mtime))
+
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def parse_lookup_table_cached(profile, lookup_table, mtime):
+
 		try:
 			lookup_open = open(lookup_table, 'r', encoding = "ISO-8859-1")
 		except:
 			raise Exception("\nERROR: Invalid lookup_table directory and/or file\n")
 		lookup_allowed = lookup_open.readlines()
-		profile_lookup = []
+		profile_lookup = {}
 		for line in lookup_allowed:	
 			if (line.startswith(profile)):
 				line_attribs = line.split('\t')
@@ -371,24 +512,21 @@ class Curation(object):
 				else:
 					start = int(start_end[0])
 					end = int(start_end[0])
-				lookup_df = pd.DataFrame({'Flag': [flag], 'Start': [start], 'End': [end]})
-				profile_lookup.append(lookup_df)
+				starts, ends = profile_lookup.setdefault(flag, ([], []))
+				starts.append(start)
+				ends.append(end)
 
-		if profile_lookup != []:
-			lookup_df = pd.concat(profile_lookup, ignore_index = True)
-		else:
-			lookup_df = pd.DataFrame({'Flag': ['XXX'], 'Start': [-1], 'End': [-1]})
+		# Allowed (start, end) ranges of each flag as arrays, so a lookup check is a single vectorized comparison
+		lookup = {flag: (np.array(starts), np.array(ends)) for flag, (starts, ends) in profile_lookup.items()}
 
-		return(lookup_df)
+		return(lookup)
 
-	# Save the MUSCLE alignment if there were no insertions
+	# Save the MUSCLE alignment, passed in as a fasta string, if there were no insertions
 	@staticmethod
 	def save_alignment(query_acc, alignment, output_dir):
 
-		with open(alignment, 'r') as file1:
-			with open(output_dir+"/"+query_acc+"_aligned.fasta", 'w') as file2:
-				for line in file1:
-					file2.write(line)
+		with open(output_dir+"/"+query_acc+"_aligned.fasta", 'w') as file:
+			file.write(alignment)
 
 
 
@@ -404,6 +542,11 @@ class MolSeq(object):
         self.seq_id = str(accession).strip()
         self.seq = str(sequence).strip()
 
+        # Byte view of the sequence and its character histogram, so every count below is a single lookup
+        # instead of another pass over the sequence
+        self._arr = np.frombuffer(self.seq.encode('ascii', 'replace'), dtype=np.uint8)
+        self._counts = np.bincount(self._arr, minlength=256)
+
     def get_seq_id(self):
         
         return self.seq_id
@@ -422,21 +565,41 @@ class MolSeq(object):
 
     def to_fasta(self):
         
-        return ">{}\n{}".format(self.get_seq_id(), self.get_seq())
+        return ">{}\n{}".format(self.seq_id, self.seq)
+
+    # Iterate over the (ID, sequence) records of a fasta file, given as a path or an open handle.  This is a
+    # lightweight stand-in for SeqIO.parse when only the ID and the sequence string are needed
+    @staticmethod
+    def read_fasta(fasta):
+
+        handle = open(fasta) if isinstance(fasta, str) else fasta
+        try:
+            seq_id = None
+            lines = []
+            for line in handle:
+                if line.startswith('>'):
+                    if seq_id is not None:
+                        yield seq_id, ''.join(lines).replace(' ', '')
+                    title = line[1:].strip()
+                    seq_id = title.split(None, 1)[0] if title else ''
+                    lines = []
+                else:
+                    lines.append(line.strip())
+            if seq_id is not None:
+                yield seq_id, ''.join(lines).replace(' ', '')
+        finally:
+            if handle is not fasta:
+                handle.close()
 
     # Counting the regular nucleotides of the nucelic acid sequence
     def count_regular_nucs(self):
         
-        a = self.get_seq().count('a') + self.get_seq().count('A')
-        c = self.get_seq().count('c') + self.get_seq().count('C')
-        g = self.get_seq().count('g') + self.get_seq().count('G')
-        t = self.get_seq().count('t') + self.get_seq().count('T')
-        return a + c + g + t
+        return int(self._counts[REGULAR_NUCS].sum())
 
     # Count the indeterminate, N's, of the NA sequence
     def count_indeterminate_nucs(self):
         
-        return self.get_seq().count('n') + self.get_seq().count('N')
+        return int(self._counts[INDETERMINATE_NUCS].sum())
 
     # Return the percentage of Ns in the sequence
     def get_n_content(self):
@@ -456,7 +619,7 @@ class MolSeq(object):
 # those mutations.
 class InDelSubs(object):
 
-	# This object just expects the profile alignment in fasta, computed in a separate module.
+	# This object just expects the profile alignment in fasta (a file path or an open handle), computed in a separate module.
 	# This alignment is not assumed to be have preserved length of the original profile because
 	# it needs to identify potential insertions.  Hence, the primary purpose of this init object
 	# is to grab ahold of "non-keep-length" insertions and deletion positions for later computing
@@ -464,102 +627,94 @@ class InDelSubs(object):
 	def __init__(self, alignment):
 
 		# Get all the sequences from the alignment
-		sequences = []
-		for seq_record in SeqIO.parse(alignment, 'fasta'):
-			seq = str(seq_record.seq)
-			sequences.append(seq)
+		sequences = [seq for seq_id, seq in MolSeq.read_fasta(alignment)]
 
 		query_seq = sequences[len(sequences)-1]
 		profile_seqs = sequences[:len(sequences)-1]
 
+		# Byte views of the query and of the profile sequences stacked as a (sequences x columns) matrix,
+		# so gap positions can be found column-wise for the whole profile at once.  Only the matrix of the
+		# profile is kept, the flag methods compare against its columns rather than the profile strings
+		query_arr = np.frombuffer(query_seq.encode('ascii'), dtype=np.uint8)
+		profile_arr = np.frombuffer(''.join(profile_seqs).encode('ascii'), dtype=np.uint8).reshape(len(profile_seqs), -1)
+
 		# Deletion positions, denoted as gaps, within the query sequence.
 		# These positions are with respect to the Non-Keeplength alginment
 		# nkdp = Non-Keeplength Deletion Positions
-		nkdp = set([i for i, ltr in enumerate(query_seq) if ltr == "-"])
-
-		first_seq_dashes = set([i for i, ltr in enumerate(profile_seqs[0]) if ltr == "-"])
-		profile_seqs_minus = profile_seqs[1:len(profile_seqs)]
-
-		profile_dash_union = first_seq_dashes
-		for seq in profile_seqs_minus:
-			seq_dashes = set([i for i, ltr in enumerate(seq) if ltr == "-"])
-			profile_dash_union = profile_dash_union.union(seq_dashes)
+		nkdp = np.flatnonzero(query_arr == ord('-'))
 
-		# Required for computing the insertions positions
-		profile_dash_intsct = first_seq_dashes
-		for seq in profile_seqs_minus:
-			seq_dashes = set([i for i, ltr in enumerate(seq) if ltr == "-"])
-			profile_dash_intsct = profile_dash_intsct.intersection(seq_dashes)
+		# Columns with a gap in any of the profile sequences, and columns that are gaps in all of them.
+		# The latter is required for computing the insertions positions
+		profile_gaps = profile_arr == ord('-')
+		profile_dash_union = np.flatnonzero(profile_gaps.any(axis = 0))
+		profile_dash_intsct = np.flatnonzero(profile_gaps.all(axis = 0))
 
 		# Insertion positions, denoted as gaps conserved accross entire profile but
 		# not in the query.  These positions are with respect to the Non-Keeplength alignment
 		# nkip = Non-Keeplength Insertion Positions
-		nkip = set(profile_dash_intsct - nkdp)
+		nkip = np.setdiff1d(profile_dash_intsct, nkdp)
 
 		# Accepted deletion positions are gaps/dashes that exist in the profile sequences.
 		# These positions are with respect to the Non-Keeplength alignment.
 		# nkadp = Non-Keeplenght Accepted Deletion Positions
-		nkadp = set(profile_dash_union - nkip)
-
-		# Group together non-keep-length sequential deletions as a list of lists
-		del_groups = []
-		flag_dels = list(set(set(nkdp) - set(nkadp)))
-		flag_dels = np.array(flag_dels)
-		flag_dels = np.sort(flag_dels)
-		for k, g in groupby(enumerate(flag_dels), lambda ix: ix[0] - ix[1]):
-			del_groups.append(list(map(itemgetter(1), g)))
-
-		# Group together non-keep-length sequential insertions as a list of lists
-		ins_groups = []
-		nkip = np.array(list(nkip))
-		nkip = np.sort(nkip)
-		for k, g in groupby(enumerate(nkip), lambda ix: ix[0] - ix[1]):
-			ins_groups.append(list(map(itemgetter(1), g)))
+		nkadp = np.setdiff1d(profile_dash_union, nkip)
 
+		# Group together non-keep-length sequential deletions as a list of position arrays
+		flag_dels = np.setdiff1d(nkdp, nkadp)
+		del_groups = self.consecutive_runs(flag_dels)
+
+		# Group together non-keep-length sequential insertions as a list of position arrays
+		ins_groups = self.consecutive_runs(nkip)
+
+		# Positions are kept as sorted numpy arrays rather than sets
 		self.nkdp = nkdp
 		self.nkip = nkip
 		self.nkadp = nkadp
 		self.query_seq = query_seq
-		self.profile_seqs = profile_seqs
+		self.query_arr = query_arr
+		self.profile_arr = profile_arr
 		self.del_groups = del_groups
 		self.ins_groups = ins_groups
 
-	# Reports the flags triggered by deletions. Requires the processed boundary file and
-	# lookup table file as pandas dataframes.
-	def deletion_flags(self, boundary_df, lookup_df):
+	# Reports the flags triggered by deletions. Requires the processed
+	# boundary file as a pandas dataframe and the lookup table as a dictionary of allowed ranges per flag.
+	def deletion_flags(self, boundary_df, lookup):
+
+		# Needed for adjusting profile positions to query positions. The position arrays are sorted,
+		# so the number of insertions/deletions before a position is a binary search
+		all_profile_ins = self.nkip - np.arange(len(self.nkip))
+		all_profile_del = self.nkdp - np.searchsorted(self.nkip, self.nkdp, side = 'left') + 1
 
-		# Needed for adjusting profile positions to query positions
-		all_profile_ins = [(j-len([i for i in self.nkip if i <= j]))+1 for j in self.nkip]
-		all_profile_del = [(j-len([i for i in self.nkip if i < j]))+1 for j in self.nkdp]
+		# Annotated regions as arrays so the regions overlapping each group are found without a pandas filter
+		region_names, region_starts, region_ends = self.region_arrays(boundary_df)
 
 		flags = []
 		for pos in self.del_groups:
 			
 			# Profile and query deletions in the group. profile_del has exact profile positions
 			# but query_del has the positions in the query proceeding deletions event
-			profile_del = [(j-len([i for i in self.nkip if i < j]))+1 for j in pos]
-			query_del = [(j-len([i for i in self.nkdp if i <= j]))+1 for j in pos]
+			profile_del = pos - np.searchsorted(self.nkip, pos, side = 'left') + 1
+			query_del = pos - np.searchsorted(self.nkdp, pos, side = 'right') + 1
 
 			# This will get ALL regions for which the deletion gaps may be overlapping
-			regions = boundary_df[(boundary_df['Start'] <= profile_del[len(profile_del)-1]) & (boundary_df['End'] >= profile_del[0])]
-			regions = regions.to_dict('records')
+			regions = np.flatnonzero((region_starts <= profile_del[len(profile_del)-1]) & (region_ends >= profile_del[0]))
 			
 			# Loop through all possible regions for which gaps may be overlapping
 			for reg in regions:
-				region = reg['Region']
+				region = region_names[reg]
 				
 				# Annotated region start end with respect to profile
-				start_p = reg['Start']
-				end_p = reg['End']
+				start_p = region_starts[reg]
+				end_p = region_ends[reg]
 				
 				# Annotated region start end with respect to query
 				# Take into account insertions and deletions occuring before the profile position
-				start_q = start_p + len([i for i in all_profile_ins if i < start_p]) - len([j for j in all_profile_del if j <= start_p])
-				end_q = end_p + len([i for i in all_profile_ins if i < end_p]) - len([j for j in all_profile_del if j <= end_p])
+				start_q = start_p + np.searchsorted(all_profile_ins, start_p, side = 'left') - np.searchsorted(all_profile_del, start_p, side = 'right')
+				end_q = end_p + np.searchsorted(all_profile_ins, end_p, side = 'left') - np.searchsorted(all_profile_del, end_p, side = 'right')
 
 				# Positions of deletions in the annotated region with respect to profile and query
-				region_dels_p = [i for i in profile_del if start_p <= i <= end_p]
-				region_dels_q = [i for i in query_del if start_q <= i <= end_q]
+				region_dels_p = profile_del[(profile_del >= start_p) & (profile_del <= end_p)]
+				region_dels_q = query_del[(query_del >= start_q) & (query_del <= end_q)]
 
 				# This will not allow flagging of sequences that are simply shorter;
 				# ie, gaps at the beginning or end of sequence relative to profile
@@ -578,17 +733,17 @@ class InDelSubs(object):
 				elif (region == 'CTS3'):
 					flags.append(tuple(("3'CTS-del", profile_pos, query_pos, "del", len(region_dels_p))))
 				elif (region == 'NCR5'):
-					if self.check_lookup(lookup_df, "5'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+					if self.check_lookup(lookup, "5'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 						flags.append(tuple(("5'NCR-del", profile_pos, query_pos, "del", len(region_dels_p))))
 				elif (region == 'NCR3'):
-					if self.check_lookup(lookup_df, "3'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+					if self.check_lookup(lookup, "3'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 						flags.append(tuple(("3'NCR-del", profile_pos, query_pos, "del", len(region_dels_p))))
 				elif (region == 'CDS'):
 					if (len(pos) % 3) == 0:
-						if self.check_lookup(lookup_df, "CDS-3Xdel", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+						if self.check_lookup(lookup, "CDS-3Xdel", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 							flags.append(tuple(("CDS-3Xdel", profile_pos, query_pos, "del", len(region_dels_p))))
 					else:
-						if self.check_lookup(lookup_df, "CDS-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+						if self.check_lookup(lookup, "CDS-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 							flags.append(tuple(("CDS-del", profile_pos, query_pos, "del", len(region_dels_p))))
 
 		return flags
@@ -597,14 +752,15 @@ class InDelSubs(object):
 	def insertion_flags(self, boundary_df):
 
 		profile_length = boundary_df['End'][4]
+		region_names, region_starts, region_ends = self.region_arrays(boundary_df)
 
 		flags = []
 		for pos in self.ins_groups:
 
 			ins_muts = self.query_seq[pos[0]:pos[len(pos)-1]+1].upper()
 
-			profile_ins = [(j-len([i for i in self.nkip if i <= j]))+1 for j in pos]
-			query_ins = [(j-len([i for i in self.nkdp if i < j]))+1 for j in pos]
+			profile_ins = pos - np.searchsorted(self.nkip, pos, side = 'right') + 1
+			query_ins = pos - np.searchsorted(self.nkdp, pos, side = 'left') + 1
 
 			if len(pos) > 1:
 				query_pos = str(query_ins[0])+".."+str(query_ins[len(query_ins)-1])
@@ -620,8 +776,7 @@ class InDelSubs(object):
 				flags.append(tuple(("3'NCR-ext", profile_pos, query_pos, ins_muts, len(pos))))
 				continue
 
-			region = boundary_df[(boundary_df['Start'] <= profile_ins[len(profile_ins)-1]) & (boundary_df['End'] >= profile_ins[0])]
-			region = list(region['Region'])[0]
+			region = region_names[(region_starts <= profile_ins[len(profile_ins)-1]) & (region_ends >= profile_ins[0])][0]
 
 			# Go through each of the possible flags
 			if (region == 'CTS5'):
@@ -659,23 +814,20 @@ class InDelSubs(object):
 		CTS5_end_adj = CTS5_end + sum([len(self.ins_groups[i]) for i in range(len(self.ins_groups)) if self.ins_groups[i][0] < CTS5_end])
 		CTS3_end_adj = CTS3_end + sum([len(self.ins_groups[i]) for i in range(len(self.ins_groups)) if self.ins_groups[i][0] < CTS3_end])
 
-		# Get the CTS regions of the query sequence
-		CTS5_query = self.query_seq[CTS5_start_adj:CTS5_end_adj+1]
-		CTS3_query = self.query_seq[CTS3_start_adj:CTS3_end_adj+1]
+		# A CTS position is a substitution if the query character matches none of the profile sequences
+		# in that column, unless the column is an insertion or deletion
+		indel_positions = np.union1d(self.nkip, self.nkdp)
 
-		cts5_muts = [i for i in range(len(CTS5_query)) if CTS5_query[i] not in [seq[CTS5_start_adj:CTS5_end_adj+1][i]
-			for seq in self.profile_seqs] and not ((i in self.nkip) or (i in self.nkdp))]
+		cts5_match = (self.profile_arr[:, CTS5_start_adj:CTS5_end_adj+1] == self.query_arr[CTS5_start_adj:CTS5_end_adj+1]).any(axis = 0)
+		cts5_cols = CTS5_start_adj + np.arange(len(cts5_match))
+		cts5_muts = cts5_cols[~cts5_match & ~np.isin(cts5_cols, indel_positions)]
 
-		cts3_muts = [i+CTS3_start_adj for i in range(len(CTS3_query)) if CTS3_query[i] not in [seq[CTS3_start_adj:CTS3_end_adj+1][i] 
-			for seq in self.profile_seqs] and not ((i+CTS3_start_adj in self.nkip) or (i+CTS3_start_adj in self.nkdp))]
+		cts3_match = (self.profile_arr[:, CTS3_start_adj:CTS3_end_adj+1] == self.query_arr[CTS3_start_adj:CTS3_end_adj+1]).any(axis = 0)
+		cts3_cols = CTS3_start_adj + np.arange(len(cts3_match))
+		cts3_muts = cts3_cols[~cts3_match & ~np.isin(cts3_cols, indel_positions)]
 
-		cts5_positions = []
-		for k, g in groupby(enumerate(cts5_muts), lambda ix: ix[0] - ix[1]):
-			cts5_positions.append(list(map(itemgetter(1), g)))
-
-		cts3_positions = []
-		for k, g in groupby(enumerate(cts3_muts), lambda ix: ix[0] - ix[1]):
-			cts3_positions.append(list(map(itemgetter(1), g)))
+		cts5_positions = self.consecutive_runs(cts5_muts)
+		cts3_positions = self.consecutive_runs(cts3_muts)
 
 		flags = []
 
@@ -683,10 +835,10 @@ class InDelSubs(object):
 		for pos in cts5_positions:
 			subs = self.query_seq[pos[0]:pos[len(pos)-1]+1].upper()
 			# Check if the current substituions are just N characters, continue loop if so and do not flag
-			if len(set(list(subs))) == 1 and list(set(list(subs)))[0] == 'N':
+			if np.isin(self.query_arr[pos], INDETERMINATE_NUCS).all():
 				continue
-			profile_sub = [(j-len([i for i in self.nkip if i < j]))+1 for j in pos]
-			query_sub = [(j-len([i for i in self.nkdp if i < j]))+1 for j in pos]
+			profile_sub = pos - np.searchsorted(self.nkip, pos, side = 'left') + 1
+			query_sub = pos - np.searchsorted(self.nkdp, pos, side = 'left') + 1
 
 			if len(pos) > 1:
 				profile_pos = str(profile_sub[0])+".."+str(profile_sub[len(profile_sub)-1])
@@ -700,10 +852,10 @@ class InDelSubs(object):
 		#Check for 3'CTS mutations:
 		for pos in cts3_positions:
 			subs = self.query_seq[pos[0]:pos[len(pos)-1]+1].upper()
-			if len(set(list(subs))) == 1 and list(set(list(subs)))[0] == 'N':
+			if np.isin(self.query_arr[pos], INDETERMINATE_NUCS).all():
 				continue
-			profile_sub = [(j-len([i for i in self.nkip if i < j]))+1 for j in pos]
-			query_sub = [(j-len([i for i in self.nkdp if i < j]))+1 for j in pos]
+			profile_sub = pos - np.searchsorted(self.nkip, pos, side = 'left') + 1
+			query_sub = pos - np.searchsorted(self.nkdp, pos, side = 'left') + 1
 
 			if len(pos) > 1:
 				profile_pos = str(profile_sub[0])+".."+str(profile_sub[len(profile_sub)-1])
@@ -716,13 +868,28 @@ class InDelSubs(object):
 
 		return flags
 
+	# The region names, start positions, and end positions of the boundary dataframe as arrays
+	@staticmethod
+	def region_arrays(boundary_df):
+
+		return(boundary_df['Region'].to_numpy(), boundary_df['Start'].to_numpy(), boundary_df['End'].to_numpy())
+
+	# Split a sorted array of positions into runs of consecutive positions
+	@staticmethod
+	def consecutive_runs(positions):
+
+		if len(positions) == 0:
+			return([])
+
+		return(np.split(positions, np.flatnonzero(np.diff(positions) != 1) + 1))
+
 	# Check the lookup table to determine if the flag gets accepted.
 	@staticmethod
-	def check_lookup(lookup_df, flag, start, end):
+	def check_lookup(lookup, flag, start, end):
 
-		table = lookup_df[(lookup_df['Flag'] == flag) & (lookup_df['Start'] <= start) & (lookup_df['End'] >= end)]
+		starts, ends = lookup.get(flag, (NO_RANGES, NO_RANGES))
 
-		if len(table) > 0:
+		if np.any((starts <= start) & (ends >= end)):
 			return("PASS")
 		else:
 			return("FAIL")
@@ -734,29 +901,141 @@ class InDelSubs(object):
 # sequence and use that to choose the profile and guide the rest of auto-curation.
 class Blast(object):
 
-	# Intialize the blasting object by passing in the query sequence and optional blast database.
+	# Intialize the blasting object by passing in the query sequence (a fasta file path or an open handle)
+	# and optional blast database.
 	# The blast database should be pre-computed and stored somewhere, otherwise, a blast database
 	# can be passed into the init function.  The default parameters are the default locations of the
-	# blast database and blast command line program.
+	# blast database and blast command line program.  Unless a blast result file is given, results are
+	# written to a temp file of their own that is removed once read, so concurrent curations never share a result file.
+	# If a DIAMOND database of the translated profiles exists (see build_blast_db.py), DIAMOND is used
+	# to find the profile and blastn is only run when DIAMOND finds no hit.  DIAMOND only picks the profile:
+	# the identity of a DIAMOND hit is left as nan, since an amino acid identity is not a nucleotide identity.
 	def __init__(self, query, blast_db = 'blast/flu_profiles_db.fasta', blastn_cmd = 'blast/blastn', 
-		blast_result = 'blast/blast_result.xml'):
+		blast_result = None, diamond_db = 'blast/flu_profiles_db.dmnd', diamond_cmd = 'diamond'):
+
+		# Only the top hit of the (first) query is needed
+		top_hits = self.search(self.read_query(query), blast_db, blastn_cmd, blast_result, diamond_db, diamond_cmd, 1)
+		top_hit = next(iter(top_hits.values()), "")
+
+		self.profile, self.identity = self.parse_top_hit(top_hit)
+
+	# BLAST a batch of query fasta files (paths or open handles) with a single blastn run, so the BLAST startup
+	# and database load are paid once rather than per query.  Returns a Blast object for each query, in order
+	@classmethod
+	def batch(cls, queries, blast_db = 'blast/flu_profiles_db.fasta', blastn_cmd = 'blast/blastn', 
+		blast_result = None, diamond_db = 'blast/flu_profiles_db.dmnd', diamond_cmd = 'diamond', num_threads = os.cpu_count() or 1):
+
+		# Combine the queries into one fasta, with the index of the query as the sequence ID so that the
+		# results can be matched back to their query.  A repeated sequence, found by a hash of the sequence,
+		# is only BLASTed once and its queries all share the ID of its first query
+		batch_fasta = []
+		query_ids = []
+		seq_ids = {}
+		for i, query in enumerate(queries):
+			query_id = str(i)
+			for seq_id, seq in MolSeq.read_fasta(query):
+				query_id = seq_ids.setdefault(hashlib.blake2b(seq.encode(), digest_size = 16).digest(), query_id)
+				if query_id == str(i):
+					batch_fasta.append(">"+query_id+"\n"+seq+"\n")
+				break
+			query_ids.append(query_id)
+
+		top_hits = cls.search("".join(batch_fasta), blast_db, blastn_cmd, blast_result, diamond_db, diamond_cmd, num_threads)
+
+		blasts = []
+		for query_id in query_ids:
+			b = cls.__new__(cls)
+			b.profile, b.identity = cls.parse_top_hit(top_hits.get(query_id, ""))
+			blasts.append(b)
+
+		return(blasts)
+
+	# Search the query fasta, passed in as a string and piped to the search on stdin, against the profiles
+	# and return the top hit line of each query ID that has a hit.  DIAMOND blastx is tried first when its
+	# database and executable are available, and blastn is then only run on the queries DIAMOND has no hit for.
+	# DIAMOND hit lines only have the subject title.
+	@staticmethod
+	def search(query_fasta, blast_db, blastn_cmd, blast_result, diamond_db, diamond_cmd, num_threads):
 
-		# Blast query against database of profile sequences
-		cmdline = NcbiblastnCommandline(cmd=blastn_cmd, query=query, db=blast_db, outfmt=5, out=blast_result)
-		stdout, stderr = cmdline()
+		# Without a given result file, the results go to a new temp file that is removed once it has been read
+		remove_result = blast_result is None
+		if remove_result:
+			fd, blast_result = tempfile.mkstemp(prefix = 'blast_result_', suffix = '.txt')
+			os.close(fd)
 
-		result_handle = open(blast_result)
-		for result in NCBIXML.parse(result_handle):
-			if len(result.alignments) > 0:
-				profile = result.alignments[0].title.split("|")[3]
-				identity = float(result.alignments[0].hsps[0].identities)/float(result.alignments[0].hsps[0].align_length)
+		try:
+			top_hits = {}
+			if os.path.exists(diamond_db) and shutil.which(diamond_cmd):
+				if os.path.exists(blast_result):
+					os.remove(blast_result)
+				cmd = [diamond_cmd, 'blastx', '--query', '/dev/stdin', '--db', diamond_db, '--outfmt', '6', 'qseqid', 'stitle',
+					'--max-target-seqs', '1', '--threads', str(num_threads), '--quiet', '-o', blast_result]
+				subprocess.run(cmd, input = query_fasta, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, text = True)
+				if os.path.exists(blast_result):
+					top_hits = Blast.read_top_hits(blast_result)
+
+				# Only the queries DIAMOND missed are left for blastn
+				query_fasta = "".join(">"+seq_id+"\n"+seq+"\n" for seq_id, seq in MolSeq.read_fasta(io.StringIO(query_fasta))
+					if seq_id not in top_hits)
+				if not query_fasta:
+					return(top_hits)
+
+			# Blast query against database of profile sequences.  Tabular output with just the query ID, subject
+			# title, identities and alignment length, and only the best HSP of each hit, since only the top hits are needed
+			cmdline = NcbiblastnCommandline(cmd=blastn_cmd, query="-", db=blast_db, outfmt="6 qseqid stitle nident length", 
+				max_hsps=1, out=blast_result, num_threads=num_threads)
+			stdout, stderr = cmdline(stdin=query_fasta)
+
+			for query_id, top_hit in Blast.read_top_hits(blast_result).items():
+				top_hits.setdefault(query_id, top_hit)
+
+			return(top_hits)
+		finally:
+			if remove_result and os.path.exists(blast_result):
+				os.remove(blast_result)
+
+	# Read a tabular ([Query ID]\t...) search result, keeping the first line of each query ID, which is
+	# the first HSP of its top hit
+	@staticmethod
+	def read_top_hits(blast_result):
+
+		top_hits = {}
+		with open(blast_result) as result_handle:
+			for line in result_handle:
+				qseqid, sep, top_hit = line.rstrip("\n").partition("\t")
+				if qseqid not in top_hits:
+					top_hits[qseqid] = top_hit
+
+		return(top_hits)
+
+	# Read the whole query fasta, given as a file path or an open handle, into a string
+	@staticmethod
+	def read_query(query):
+
+		if hasattr(query, 'read'):
+			return(query.read())
+
+		with open(query) as query_handle:
+			return(query_handle.read())
+
+	# Get the profile and identity from a tabular top hit line ([Subject title]\t[Identities]\t[Alignment length]).
+	# Subject titles are [Sequence ID]|[Profile].  A DIAMOND hit line is just the subject title, so it has no identity
+	@staticmethod
+	def parse_top_hit(top_hit):
+
+		if top_hit:
+			title, sep, counts = top_hit.partition("\t")
+			profile = title.rpartition("|")[2]
+			if counts:
+				identities, align_length = counts.split("\t")
+				identity = int(identities)/int(align_length)
 			else:
-				profile = "Unknown"
-				identity = "Unknown"
-			break
+				identity = math.nan
+		else:
+			profile = "Unknown"
+			identity = math.nan
 
-		self.profile = profile
-		self.identity = identity
+		return(profile, identity)
 	
 	# Return the profile name mapping to the query sequence
 	def get_profile(self):
@@ -774,17 +1053,50 @@ class Blast(object):
 		if self.profile == "Unknown":
 			strain = "Unknown"
 		else:
-			strain = self.profile.split("_")
-			strain = strain[:len(strain)-1]
-			strain = "_".join(strain)
+			strain = self.profile.rpartition("_")[0]
 
 		return(strain)
 
 
+# Curate a single query, given as a fasta string, returning the Curation object, its formatted report, and the
+# compute time for the sequence.  Kept at module level so that it can be run in pool worker processes.  A Blast
+# object from an earlier batch BLAST of the query can be passed in so that the query is not BLASTed again.
+# reports are the (label, Curation method) flag reports to include after the accession and subtype, laid out
+# by template (see report_template)
+def curate_one(query_fasta, blast = None, reports = (), template = None):
+
+	start = time.time()
+	cur = Curation(io.StringIO(query_fasta), blast = blast)
+	end = time.time()
+
+	# The report, flag tables included, is formatted here so that the formatting is spread across the workers
+	if template is None:
+		template = report_template(reports)
+	output = template.format(cur.get_accession(), cur.get_strain(), cur.get_identity(), *[report(cur) for label, report in reports])
+
+	return(cur, output, round(end - start, 3))
+
+# The format string of a record's report for the given flag reports: the accession, subtype, and identity, then each
+# report under its label.  Built once per run, since the reports only depend on the --flag option
+def report_template(reports):
+
+	return("Accession: {}\nSubtype: {}\nPercent Identity: {}\n" + "".join([label+" {}\n" for label, report in reports]) + "\n\n")
+
+# argparse type for a count that must be at least 1, such as the number of processes
+def positive_int(value):
+
+	number = int(value)
+	if number < 1:
+		raise argparse.ArgumentTypeError("must be at least 1, got "+value)
+
+	return(number)
+
+
 # Main program for running the whole script from commandline
 # Required argument: --query [QUERY FASTA]
 # Optional argument: --flag [muts/ambig/ins/del/sub] (ie, the type of flags to return)
 # Optional argument: --table6 [TABLE6 FILE PATH]
+# Optional argument: --processes [NUMBER OF PROCESSES] (ie, how many sequences to curate in parallel)
 if __name__ == "__main__":
 
 	parser = argparse.ArgumentParser()
@@ -793,75 +1105,43 @@ if __name__ == "__main__":
 	parser.add_argument('--query', dest = 'query', type = str)
 	
 	# Optional arguments
-	parser.add_argument('--flag', dest = 'flag', type = str)
+	parser.add_argument('--flag', dest = 'flag', type = str, choices = ['mut', 'ambig', 'ins', 'del', 'sub'])
 	parser.add_argument('--table6', dest = 'table6', type = str)
+	parser.add_argument('--processes', dest = 'processes', type = positive_int, default = os.cpu_count() or 1)
 	args = parser.parse_args()
 
 	if (not args.query):
 		sys.exit("\nERROR: No query sequence input\n")
-	if (args.flag and (args.flag != 'mut' and args.flag != 'ambig' and args.flag != 'ins' and args.flag != 'del' and args.flag != 'sub')):
-		sys.exit("\nERROR: Invalid flag argument\n --flag [all/ambig/ins/del/sub]\n")
 	if (args.table6):
 		table6 = args.table6
 	else:
 		table6 = 'outputs/Table6_Jan2019Release.txt'
 
-	for seq_record in SeqIO.parse(args.query, 'fasta'):
-		seq_id = str(seq_record.id)
-		seq = str(seq_record.seq)
-		seq_fasta = MolSeq(seq_id, seq).to_fasta()
-		with open('query.fasta', 'w') as f:	f.write(seq_fasta)
-		start = time.time()
-		cur = Curation('query.fasta')
-		if not args.flag:
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Percent Identity:", cur.get_identity())
-			print("Summary Flag:", cur.summary_flag())
-			print("Ambiguity Flags:", cur.ambiguity_flags())
-			print("Mutation Flags:\n", cur.mutation_flags())
-			print('\n')
-		elif args.flag == 'mut':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Percent Identity:", cur.get_identity())
-			print("Mutation Flags:\n", cur.mutation_flags())
-			print('\n')
-		elif args.flag == 'ambig':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Percent Identity:", cur.get_identity())
-			print("Summary Flag:", cur.summary_flag())
-			print("Ambiguity Flags:", cur.ambiguity_flags())
-			print('\n')
-		elif args.flag == 'ins':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Percent Identity:", cur.get_identity())
-			print("Summary Flag:", cur.summary_flag())
-			print("Insertion Flags:\n", cur.insertion_flags())
-			print('\n')
-		elif args.flag == 'del':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Percent Identity:", cur.get_identity())
-			print("Summary Flag:", cur.summary_flag())
-			print("Deletion Flags:\n", cur.deletion_flags())
-			print('\n')
-		elif args.flag == 'sub':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Percent Identity:", cur.get_identity())
-			print("Summary Flag:", cur.summary_flag())
-			print("Substitution Flags:\n", cur.substitution_flags())
-			print('\n')
-		cur.update_table6(Table6 = table6)
-		end = time.time()
-		print("Compute time for sequence:", round(end - start, 3))
-		print('\n')
-
-
-
-
-
-
+	# Split the query into a fasta string per record so that the records can be curated in parallel.  The
+	# records are read as plain strings, so no SeqRecord or MolSeq is built just to write them back out,
+	# and they are passed along in memory rather than through a query file per record
+	queries = [">"+seq_id+"\n"+seq for seq_id, seq in MolSeq.read_fasta(args.query)]
+
+	# The flag reports printed for every record, after its accession and subtype, for each --flag option
+	summary = ("Summary Flag:", Curation.summary_flag)
+	flag_reports = {None: [summary, ("Ambiguity Flags:", Curation.ambiguity_flags), ("Mutation Flags:\n", Curation.mutation_flags)],
+		'mut': [("Mutation Flags:\n", Curation.mutation_flags)],
+		'ambig': [summary, ("Ambiguity Flags:", Curation.ambiguity_flags)],
+		'ins': [summary, ("Insertion Flags:\n", Curation.insertion_flags)],
+		'del': [summary, ("Deletion Flags:\n", Curation.deletion_flags)],
+		'sub': [summary, ("Substitution Flags:\n", Curation.substitution_flags)]}
+	reports = flag_reports[args.flag]
+	template = report_template(reports)
+
+	# BLAST all of the records in a single run, then curate the records across worker processes.  Results
+	# come back in input order, and Table 6 is only ever updated from this process.  Table 6 is read once,
+	# updated in memory for each record, and written back once at the end (or if curation stops early)
+	blasts = Blast.batch([io.StringIO(query) for query in queries], num_threads = args.processes) if queries else []
+	table6_df = Curation.read_table6(table6)
+	try:
+		with ProcessPoolExecutor(max_workers = args.processes) as executor:
+			for cur, output, compute_time in executor.map(partial(curate_one, reports = reports, template = template), queries, blasts, chunksize = 8):
+				table6_df = cur.add_to_table6(table6_df)
+				sys.stdout.write(output+"Compute time for sequence: "+str(compute_time)+"\n\n\n")
+	finally:
+		Curation.write_table6(table6_df, table6)
@@ -4,20 +4,34 @@
 # query sequence against
 
 import os
+import shutil
 import pandas as pd
 import numpy as np
 import subprocess
 from Bio import SeqIO
+from Bio.Seq import Seq
+
+
+# The CDS start and stop columns of each profile, used for translating the profile sequences for the
+# optional DIAMOND database
+boundary_file = [file for file in os.listdir('profiles') if file.startswith('Flu_profile_boundaries')][0]
+boundaries = {}
+for line in open('profiles/'+boundary_file, 'r'):
+	if not line.startswith('#') and '|' in line:
+		fields = line.strip().split("|")
+		boundaries[fields[0]] = dict(field.split("=") for field in fields[1:])
 
 
 sequences = set()
 seq_dict = {}
+protein_dict = {}
 for file in os.listdir('profiles'):
 	if file != "precomputed_alignment.fasta" and (file.endswith('.afa') or file.endswith('.fasta')):
 		profile_name = file
+		strain_name = "_".join(file.split("_")[:-1])
 		for seq_record in SeqIO.parse('profiles/'+file, 'fasta'):
-			seq = str(seq_record.seq)
-			seq = seq.replace("-", "")
+			aligned_seq = str(seq_record.seq)
+			seq = aligned_seq.replace("-", "")
 			seq = seq.replace("~", "")
 			seq_id = str(seq_record.id)
 			seq_name = seq_id+"|"+profile_name
@@ -26,6 +40,16 @@ for file in os.listdir('profiles'):
 					seq_dict[seq_name] = seq
 					sequences.add(seq)
 
+					# Translate the CDS, cut from the aligned sequence using the profile's ATG and STOP columns.  The
+					# translation is trimmed at its first stop codon, since the ATG to STOP span of a spliced or
+					# frameshifted segment (M and NS, for instance) reads through stops
+					if boundaries.get(strain_name):
+						cds = aligned_seq[int(boundaries[strain_name]['ATG'])-1:int(boundaries[strain_name]['STOP'])]
+						cds = cds.replace("-", "").replace("~", "")
+						protein = str(Seq(cds[:len(cds)//3*3]).translate(to_stop = True))
+						if protein:
+							protein_dict[seq_name] = protein
+
 
 outfile = open("blast/flu_profiles_db.fasta", "w")
 
@@ -38,4 +62,18 @@ makeblastdb_cmd = "./blast/makeblastdb -in blast/flu_profiles_db.fasta -dbtype n
 os.system(makeblastdb_cmd)
 
 
+# DIAMOND database of the translated profile sequences, only built if DIAMOND is installed.  When this
+# database exists, the Blast object is able to use DIAMOND for the faster profile lookup
+if shutil.which("diamond"):
+	outfile = open("blast/flu_profiles_db.faa", "w")
+
+	for key in protein_dict.keys():
+		outfile.write(">" + key + "\n" + protein_dict[key] + "\n")
+
+	outfile.close()
+
+	makedb_cmd = "diamond makedb --in blast/flu_profiles_db.faa -d blast/flu_profiles_db"
+	os.system(makedb_cmd)
+
+
 			
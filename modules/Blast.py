@@ -2,34 +2,153 @@
 # ulimately deterimine the strain name ([Species]_[Segment]_[Subtype]) of the Influenza query
 # sequence and us that to choose the profile and guide the rest of auto-curation.
 
+import io
+import os
+import math
+import hashlib
+import shutil
+import tempfile
+import subprocess
+from MolSeq import MolSeq
 from Bio.Blast.Applications import NcbiblastnCommandline
-from Bio.Blast import NCBIXML
 
 class Blast(object):
 
-	# Intialize the blasting object by passing in the query sequence and optional blast database.
+	# Intialize the blasting object by passing in the query sequence (a fasta file path or an open handle)
+	# and optional blast database.
 	# The blast database should be pre-computed and stored somewhere, otherwise, a blast database
 	# can be passed into the init function.  The default parameters are the default locations of the
-	# blast database and blast command line program.
+	# blast database and blast command line program.  Unless a blast result file is given, results are
+	# written to a temp file of their own that is removed once read, so concurrent curations never share a result file.
+	# If a DIAMOND database of the translated profiles exists (see build_blast_db.py), DIAMOND is used
+	# to find the profile and blastn is only run when DIAMOND finds no hit.  DIAMOND only picks the profile:
+	# the identity of a DIAMOND hit is left as nan, since an amino acid identity is not a nucleotide identity.
 	def __init__(self, query, blast_db = 'blast/flu_profiles_db.fasta', blastn_cmd = 'blast/blastn', 
-		blast_result = 'blast/blast_result.xml'):
+		blast_result = None, diamond_db = 'blast/flu_profiles_db.dmnd', diamond_cmd = 'diamond'):
 
-		# Blast query against database of profile sequences
-		cmdline = NcbiblastnCommandline(cmd=blastn_cmd, query=query, db=blast_db, outfmt=5, out=blast_result)
-		stdout, stderr = cmdline()
+		# Only the top hit of the (first) query is needed
+		top_hits = self.search(self.read_query(query), blast_db, blastn_cmd, blast_result, diamond_db, diamond_cmd, 1)
+		top_hit = next(iter(top_hits.values()), "")
 
-		result_handle = open(blast_result)
-		for result in NCBIXML.parse(result_handle):
-			if len(result.alignments) > 0:
-				profile = result.alignments[0].title.split("|")[3]
-				identity = float(result.alignments[0].hsps[0].identities)/float(result.alignments[0].hsps[0].align_length)
+		self.profile, self.identity = self.parse_top_hit(top_hit)
+
+	# BLAST a batch of query fasta files (paths or open handles) with a single blastn run, so the BLAST startup
+	# and database load are paid once rather than per query.  Returns a Blast object for each query, in order
+	@classmethod
+	def batch(cls, queries, blast_db = 'blast/flu_profiles_db.fasta', blastn_cmd = 'blast/blastn', 
+		blast_result = None, diamond_db = 'blast/flu_profiles_db.dmnd', diamond_cmd = 'diamond', num_threads = os.cpu_count() or 1):
+
+		# Combine the queries into one fasta, with the index of the query as the sequence ID so that the
+		# results can be matched back to their query.  A repeated sequence, found by a hash of the sequence,
+		# is only BLASTed once and its queries all share the ID of its first query
+		batch_fasta = []
+		query_ids = []
+		seq_ids = {}
+		for i, query in enumerate(queries):
+			query_id = str(i)
+			for seq_id, seq in MolSeq.read_fasta(query):
+				query_id = seq_ids.setdefault(hashlib.blake2b(seq.encode(), digest_size = 16).digest(), query_id)
+				if query_id == str(i):
+					batch_fasta.append(">"+query_id+"\n"+seq+"\n")
+				break
+			query_ids.append(query_id)
+
+		top_hits = cls.search("".join(batch_fasta), blast_db, blastn_cmd, blast_result, diamond_db, diamond_cmd, num_threads)
+
+		blasts = []
+		for query_id in query_ids:
+			b = cls.__new__(cls)
+			b.profile, b.identity = cls.parse_top_hit(top_hits.get(query_id, ""))
+			blasts.append(b)
+
+		return(blasts)
+
+	# Search the query fasta, passed in as a string and piped to the search on stdin, against the profiles
+	# and return the top hit line of each query ID that has a hit.  DIAMOND blastx is tried first when its
+	# database and executable are available, and blastn is then only run on the queries DIAMOND has no hit for.
+	# DIAMOND hit lines only have the subject title.
+	@staticmethod
+	def search(query_fasta, blast_db, blastn_cmd, blast_result, diamond_db, diamond_cmd, num_threads):
+
+		# Without a given result file, the results go to a new temp file that is removed once it has been read
+		remove_result = blast_result is None
+		if remove_result:
+			fd, blast_result = tempfile.mkstemp(prefix = 'blast_result_', suffix = '.txt')
+			os.close(fd)
+
+		try:
+			top_hits = {}
+			if os.path.exists(diamond_db) and shutil.which(diamond_cmd):
+				if os.path.exists(blast_result):
+					os.remove(blast_result)
+				cmd = [diamond_cmd, 'blastx', '--query', '/dev/stdin', '--db', diamond_db, '--outfmt', '6', 'qseqid', 'stitle',
+					'--max-target-seqs', '1', '--threads', str(num_threads), '--quiet', '-o', blast_result]
+				subprocess.run(cmd, input = query_fasta, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, text = True)
+				if os.path.exists(blast_result):
+					top_hits = Blast.read_top_hits(blast_result)
+
+				# Only the queries DIAMOND missed are left for blastn
+				query_fasta = "".join(">"+seq_id+"\n"+seq+"\n" for seq_id, seq in MolSeq.read_fasta(io.StringIO(query_fasta))
+					if seq_id not in top_hits)
+				if not query_fasta:
+					return(top_hits)
+
+			# Blast query against database of profile sequences.  Tabular output with just the query ID, subject
+			# title, identities and alignment length, and only the best HSP of each hit, since only the top hits are needed
+			cmdline = NcbiblastnCommandline(cmd=blastn_cmd, query="-", db=blast_db, outfmt="6 qseqid stitle nident length", 
+				max_hsps=1, out=blast_result, num_threads=num_threads)
+			stdout, stderr = cmdline(stdin=query_fasta)
+
+			for query_id, top_hit in Blast.read_top_hits(blast_result).items():
+				top_hits.setdefault(query_id, top_hit)
+
+			return(top_hits)
+		finally:
+			if remove_result and os.path.exists(blast_result):
+				os.remove(blast_result)
+
+	# Read a tabular ([Query ID]\t...) search result, keeping the first line of each query ID, which is
+	# the first HSP of its top hit
+	@staticmethod
+	def read_top_hits(blast_result):
+
+		top_hits = {}
+		with open(blast_result) as result_handle:
+			for line in result_handle:
+				qseqid, sep, top_hit = line.rstrip("\n").partition("\t")
+				if qseqid not in top_hits:
+					top_hits[qseqid] = top_hit
+
+		return(top_hits)
+
+	# Read the whole query fasta, given as a file path or an open handle, into a string
+	@staticmethod
+	def read_query(query):
+
+		if hasattr(query, 'read'):
+			return(query.read())
+
+		with open(query) as query_handle:
+			return(query_handle.read())
+
+	# Get the profile and identity from a tabular top hit line ([Subject title]\t[Identities]\t[Alignment length]).
+	# Subject titles are [Sequence ID]|[Profile].  A DIAMOND hit line is just the subject title, so it has no identity
+	@staticmethod
+	def parse_top_hit(top_hit):
+
+		if top_hit:
+			title, sep, counts = top_hit.partition("\t")
+			profile = title.rpartition("|")[2]
+			if counts:
+				identities, align_length = counts.split("\t")
+				identity = int(identities)/int(align_length)
 			else:
-				profile = "Unknown"
-				identity = 0
-			break
+				identity = math.nan
+		else:
+			profile = "Unknown"
+			identity = math.nan
 
-		self.profile = profile
-		self.identity = identity
+		return(profile, identity)
 	
 	# Return the profile name mapping to the query sequence
 	def get_profile(self):
@@ -47,9 +166,7 @@ class Blast(object):
 		if self.profile == "Unknown":
 			strain = "Unknown"
 		else:
-			strain = self.profile.split("_")
-			strain = strain[:len(strain)-1]
-			strain = "_".join(strain)
+			strain = self.profile.rpartition("_")[0]
 
 		return(strain)
 
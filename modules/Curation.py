@@ -3,41 +3,66 @@
 # This object should handle the curation of an input suquence, utilizing the profile alignments,
 # lookup table, and boundary file
 
+import io
 import os
+import math
 import re
 import pandas as pd
 import numpy as np
 import subprocess
-from Bio import SeqIO
+from Bio.Align import PairwiseAligner
 from datetime import datetime
+from functools import lru_cache
+from collections import Counter
 from Blast import Blast
 from InDelSubs import InDelSubs
 from MolSeq import MolSeq
 
 
+# Patterns for pulling the accession number out of a fasta header
+ACCESSION_SPLIT = re.compile(r'[^a-zA-Z0-9\s\w-]+')
+HAS_LETTER = re.compile(r'[a-zA-Z]')
+HAS_DIGIT = re.compile(r'[0-9]')
+
+# Local aligner for computing the identity of a query to a known profile without BLAST
+IDENTITY_ALIGNER = PairwiseAligner(mode = 'local', match_score = 1, mismatch_score = -1, open_gap_score = -1, extend_gap_score = -1)
+
+
 class Curation(object):
 
-	# This object expects a SINGLE QUERY nucleotide sequence in fasta at minimum. Optionally, it can also take a 
+	# This object expects a SINGLE QUERY nucleotide sequence in fasta at minimum, as a file path or an open handle
+	# (e.g. io.StringIO of a fasta string, so no query file needs to be written). Optionally, it can also take a 
 	# strain name denoted as [Speicies]_[Segment #]_[Subtype].  The object can also take in a specified boundary 
 	# file, lookup table file, and a directory name specifying the location of all the profile fasta files.  If
 	# those required files are not inputted as arguments, the object navigates to the default location of these
-	# files.
+	# files.  A Blast object already computed for the query (see Curation.batch) can be passed in to skip BLAST.
 	def __init__(self, query, strain_name = None, boundary_file = "profiles/Flu_profile_boundaries_20181012.txt", 
-		lookup_table = "profiles/Flu_profile_lookupTable_20181203.txt", profile_dir = "profiles", output_dir = "outputs"):
+		lookup_table = "profiles/Flu_profile_lookupTable_20181203.txt", profile_dir = "profiles", output_dir = "outputs",
+		blast = None):
 			
+		# Read the query once, then hand the fasta string to BLAST and MUSCLE rather than re-reading the file
+		query_fasta = Blast.read_query(query)
+
 		# Grab accession number and nucleotide sequence string for query sequence in the fasta file
-		accession, sequence = self.get_acc_and_seq(query)
+		accession, sequence = self.get_acc_and_seq(io.StringIO(query_fasta))
 
 		# Get the profile. Only BLAST if strain name not passed to init
 		if strain_name:
 			# Get the appropriate profile for the profile_dir based on the strain name
 			try:
-				profile = [filename for filename in os.listdir(profile_dir) if filename.startswith(strain_name)][0]
+				profiles = self.profile_index(profile_dir)
+				if strain_name in profiles:
+					profile = profiles[strain_name]
+				else:
+					profile = [filename for filename in profiles.values() if filename.startswith(strain_name)][0]
 			except:
 				raise Exception("\nERROR: Invalid profiles directory or strain name\n")
+
+			# Without a BLAST hit there is no identity yet, it is computed below
+			identity = math.nan
 		else:
 			# BLAST query to determine the appropriate profile and strain name
-			b = Blast(query)
+			b = blast if blast else Blast(io.StringIO(query_fasta))
 			profile = b.get_profile()
 			identity = b.get_identity()
 			strain_name = b.get_strain()
@@ -49,9 +74,15 @@ class Curation(object):
 			self.accession = accession
 			return
 
+		# A profile found without a nucleotide identity (a strain name was given, or DIAMOND found the profile
+		# from the translated query) gets its identity in process against the sequences of the profile
+		if math.isnan(identity):
+			profile_seqs = [seq.replace("-", "").replace("~", "") for seq_id, seq in MolSeq.read_fasta(profile_dir+'/'+profile)]
+			identity = self.reidentity(sequence, profile_seqs)
+
 		# Parse boundary and lookup table text files
 		boundary_df = self.parse_boundary_file(strain_name, boundary_file)
-		lookup_df = self.parse_lookup_table(profile, lookup_table)
+		lookup = self.parse_lookup_table(profile, lookup_table)
 
 		# Determine the ambiguity flags, if any
 		ambig_flags = []
@@ -63,16 +94,17 @@ class Curation(object):
 		if identity < 0.95:
 			ambig_flags.append("Excess-Dist")
 
-		# Compute the alignment of the query to the profile using MUSCLE
-		alignment = profile_dir+"/precomputed_alignment.fasta"
-		cmd = './muscle -maxiters 1000 -profile -in1 '+profile_dir+'/'+profile+' -in2 '+query+' -out '+alignment
-		subprocess.call(cmd, shell = True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+		# Compute the alignment of the query to the profile using MUSCLE.  The query is piped in on stdin and the
+		# alignment is read straight from MUSCLE's stdout instead of being written to and re-read from disk
+		cmd = './muscle -maxiters 2 -profile -in1 '+profile_dir+'/'+profile+' -in2 /dev/stdin'
+		alignment = subprocess.run(cmd, shell = True, input = query_fasta, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, 
+			text = True).stdout
 
 		# Initialize InDelSubs object to identify mutations from the alignment
-		muts = InDelSubs(alignment)
+		muts = InDelSubs(io.StringIO(alignment))
 		
 		# Get the Flags
-		del_flags =	muts.deletion_flags(boundary_df, lookup_df)
+		del_flags =	muts.deletion_flags(boundary_df, lookup)
 		ins_flags = muts.insertion_flags(boundary_df)
 		sub_flags = muts.substitution_flags(boundary_df)
 
@@ -91,6 +123,16 @@ class Curation(object):
 		self.strain_name = strain_name
 		self.accession = accession
 
+	# Curate a batch of SINGLE QUERY fasta files (paths or open handles), BLASTing all of them with one blastn
+	# run.  Any other arguments are passed to each Curation object.  Returns a Curation object for each query, in order
+	@classmethod
+	def batch(cls, queries, **kwargs):
+
+		query_fastas = [Blast.read_query(query) for query in queries]
+		blasts = Blast.batch([io.StringIO(query_fasta) for query_fasta in query_fastas])
+
+		return([cls(io.StringIO(query_fasta), blast = b, **kwargs) for query_fasta, b in zip(query_fastas, blasts)])
+
 	# Return a table with all mutation flags occuring in the sequence, otherwise return 'Pass' if no flags
 	# However, if no profile alignment was found in BLAST step, return 'Unknown'
 	def mutation_flags(self):
@@ -128,9 +170,9 @@ class Curation(object):
 			return("Ambig-Seq")
 
 		# Logical ordering of what to return for summary flags
-		if True in [True for flag in self.mut_flags if "CDS" in flag[0]]:
+		if any("CDS" in flag[0] for flag in self.mut_flags):
 			return("Flag-CDS")
-		elif True in [True for flag in self.mut_flags if "NCR" in flag[0] or "CTS" in flag[0]]:
+		elif any("NCR" in flag[0] or "CTS" in flag[0] for flag in self.mut_flags):
 			return("Flag-NCR")	
 		else:
 			return("Pass")
@@ -148,93 +190,107 @@ class Curation(object):
 		if self.mut_flags == []:
 			return
 
+		self.write_table6(self.add_to_table6(self.read_table6(Table6)), Table6)
+
+	# Read Table 6 into a dataframe.  When curating many sequences, read Table 6 once, add each curation to
+	# it with add_to_table6, and write it back once with write_table6 rather than calling update_table6
+	# (which reads and rewrites the whole file) for every sequence
+	@staticmethod
+	def read_table6(Table6 = 'outputs/Table6_Jan2019Release.txt'):
+
 		try:
 			table6 = pd.read_csv(Table6, sep = '\t')
 		except:
 			raise Exception("\nERROR: Invalid table6 directory and/or file\n")
 
+		return(table6)
+
+	# Write a Table 6 dataframe back to the Table 6 file
+	@staticmethod
+	def write_table6(table6, Table6 = 'outputs/Table6_Jan2019Release.txt'):
+
+		table6.to_csv(Table6, sep = '\t', index = False)
+
+	# Add the flags of this curation to a Table 6 dataframe, returning the updated dataframe
+	def add_to_table6(self, table6):
+
+		# Nothing to add without a profile or flags
+		if self.profile == "Unknown" or self.mut_flags == []:
+			return(table6)
+
 		# Revert STATUS_THIS_MONTH to Unchanged for those that were updated last month
 		# Revert CURRENT_MONTH_INCREASE count to zero if new month approached
 		# Update PAST_MONTH_INCREASE count to the value of CURRENT_MONTH_INCREASE
 		today = datetime.today()
 		current_month = datetime.today().replace(day=1)
 		table6['LAST_UPDATED'] = pd.to_datetime(table6['LAST_UPDATED'], errors='coerce').dt.floor('d')
-		past_months = table6[(table6['LAST_UPDATED'] < current_month) & (table6['STATUS_THIS_MONTH'] != "Unchanged")]
-		for ind in past_months.index:
-			table6.at[ind, 'STATUS_THIS_MONTH'] = "Unchanged"
-			table6.at[ind, 'PAST_MONTH_INCREASE'] = int(table6['CURRENT_MONTH_INCREASE'][ind])
-			table6.at[ind, 'CURRENT_MONTH_INCREASE'] = 0
-
-		# Loop through all detected flags
-		for flag in self.mut_flags:
-			if (flag[0] == "5'NCR-ext") or (flag[0] == "3'NCR-ext"):
-				table6_profile = table6[(table6['PROFILE_NAME'] == self.profile) & (table6['FLU_SUBTYPE'] == self.strain_name) & 
-				(table6['AUTO_ALIGNMENT_ISSUE'] == flag[0])]
-				# Check if flag returns something already in the table
-				if not table6_profile.empty:
-					index = table6_profile.index[0]
-					status = str(table6['STATUS_THIS_MONTH'][index])
-					acc_list = set(str(table6['ACCESSION_LIST'][index]).split(","))
-					if self.accession not in acc_list:
-						acc_list.add(self.accession)
-						acc_list = list(acc_list)
-						acc_list.sort()
-						acc_list = ",".join(acc_list)
-
-						if status == "Unchanged":
-							table6.at[index, 'STATUS_THIS_MONTH'] = str("Updated")
-							table6.at[index, 'LAST_UPDATED'] = today
-						table6.at[index, 'ACCESSION_TOTAL'] = int(table6['ACCESSION_TOTAL'][index])+1
-						table6.at[index, 'CURRENT_MONTH_INCREASE'] = int(table6['CURRENT_MONTH_INCREASE'][index])+1
-						table6.at[index, 'ACCESSION_LIST'] = str(acc_list)
-
-				else:
-					table6_profile = pd.DataFrame({'PROFILE_NAME': [self.profile], 'STATUS_THIS_MONTH': ["New"], 'LAST_UPDATED': [today], 
-						'FLU_SUBTYPE': [self.strain_name], 'AUTO_ALIGNMENT_ISSUE': [flag[0]], 'POS_PROFILE': [""], 'MUTATION_SUM': [""], 
-						'ACCESSION_TOTAL': [1], 'CURRENT_MONTH_INCREASE': [1], 'ACCESSION_LIST': [self.accession]})
-					table6 = pd.concat([table6, table6_profile], axis = 0)
-
-			else:
-				table6_profile = table6[(table6['PROFILE_NAME'] == self.profile) & (table6['FLU_SUBTYPE'] == self.strain_name) & 
-				(table6['AUTO_ALIGNMENT_ISSUE'] == flag[0]) & (table6['POS_PROFILE'] == flag[1])]
-				if not table6_profile.empty:
-					index = table6_profile.index[0]
-					status = str(table6['STATUS_THIS_MONTH'][index])
-					acc_list = set(str(table6['ACCESSION_LIST'][index]).split(","))
-					if self.accession not in acc_list:
-						acc_list.add(self.accession)
-						acc_list = list(acc_list)
-						acc_list.sort()
-						acc_list = ",".join(acc_list)
-
-						if status == "Unchanged":
-							table6.at[index, 'STATUS_THIS_MONTH'] = str("Updated")
-							table6.at[index, 'LAST_UPDATED'] = today
-						table6.at[index, 'ACCESSION_TOTAL'] = int(table6['ACCESSION_TOTAL'][index])+1
-						table6.at[index, 'CURRENT_MONTH_INCREASE'] = int(table6['CURRENT_MONTH_INCREASE'][index])+1
-						table6.at[index, 'ACCESSION_LIST'] = str(acc_list)
-
-						if flag[0] == "5'CTS-mut" or flag[0] == "3'CTS-mut":
-							mut_sum = str(table6['MUTATION_SUM'][index])
-							mut_sum = dict(item.split(":") for item in mut_sum.split(","))
-							if mut_sum.get(flag[3]):
-								mut_sum[flag[3]] = str(int(mut_sum[flag[3]])+1)
-							else:
-								mut_sum[flag[3]] = str(1)
-							mut_sum = ",".join([key+':'+val for key, val in mut_sum.items()])
-							table6.at[index, 'MUTATION_SUM'] = mut_sum
-				
-				else:
-					mut_sum = ""
-					if flag[0] == "5'CTS-mut" or flag[0] == "3'CTS-mut":
-						mut_sum = flag[3]+':'+str(1)
-					table6_profile = pd.DataFrame({'PROFILE_NAME': [self.profile], 'STATUS_THIS_MONTH': ["New"], 'LAST_UPDATED': [today], 
-						'FLU_SUBTYPE': [self.strain_name], 'AUTO_ALIGNMENT_ISSUE': [flag[0]], 'POS_PROFILE': [flag[1]], 'MUTATION_SUM': [mut_sum], 
-						'ACCESSION_TOTAL': [1], 'CURRENT_MONTH_INCREASE': [1], 'ACCESSION_LIST': [self.accession]})
-					table6 = pd.concat([table6, table6_profile], axis = 0)
+		past_months = (table6['LAST_UPDATED'] < current_month) & (table6['STATUS_THIS_MONTH'] != "Unchanged")
+		table6.loc[past_months, 'PAST_MONTH_INCREASE'] = table6.loc[past_months, 'CURRENT_MONTH_INCREASE'].astype(int)
+		table6.loc[past_months, 'CURRENT_MONTH_INCREASE'] = 0
+		table6.loc[past_months, 'STATUS_THIS_MONTH'] = "Unchanged"
+
+		# Key each Table 6 entry on profile, subtype, flag, and profile position. The NCR extension flags
+		# are matched regardless of profile position, so their position key is left blank.  Only the first
+		# entry for a key is ever updated
+		key_cols = ['PROFILE_NAME', 'FLU_SUBTYPE', 'AUTO_ALIGNMENT_ISSUE', 'POS_PROFILE']
+		ext_flags = ["5'NCR-ext", "3'NCR-ext"]
+		cts_flags = ["5'CTS-mut", "3'CTS-mut"]
+
+		table6_keys = table6[key_cols].astype(str)
+		table6_keys.loc[table6_keys['AUTO_ALIGNMENT_ISSUE'].isin(ext_flags), 'POS_PROFILE'] = ""
+		table6_keys['ROW'] = table6.index
+		table6_keys = table6_keys.drop_duplicates(subset = key_cols, keep = 'first')
+
+		# Build the same keys for the detected flags and merge them against Table 6 to find the
+		# entries that already exist (hits) and the ones that need to be added (misses)
+		flags = pd.DataFrame(self.mut_flags, columns = ['Flag', 'Profile Position', 'Query Position', 'Variant', 'Length'])
+		flags = pd.DataFrame({'PROFILE_NAME': self.profile, 'FLU_SUBTYPE': self.strain_name, 'AUTO_ALIGNMENT_ISSUE': flags['Flag'],
+			'POS_PROFILE': flags['Profile Position'].where(~flags['Flag'].isin(ext_flags), ""), 'VARIANT': flags['Variant']})
+		flags = flags.drop_duplicates(subset = key_cols, keep = 'first')
+		flags = flags.merge(table6_keys, how = 'left', on = key_cols)
+		hits = flags[flags['ROW'].notna()]
+		misses = flags[flags['ROW'].isna()]
+
+		# Update the existing entries, parsing the accession list only for those rows, and skipping
+		# entries that already include this accession
+		rows = hits['ROW'].astype(int).to_numpy()
+		acc_lists = [set(accs.split(",")) for accs in table6.loc[rows, 'ACCESSION_LIST'].astype(str)]
+		new_acc = np.array([self.accession not in accs for accs in acc_lists], dtype = bool)
+		variants = hits['VARIANT'].to_numpy()[new_acc]
+		cts = hits['AUTO_ALIGNMENT_ISSUE'].isin(cts_flags).to_numpy()[new_acc]
+		acc_lists = [accs for accs, new in zip(acc_lists, new_acc) if new]
+		rows = rows[new_acc]
+
+		if len(rows) > 0:
+			unchanged = rows[(table6.loc[rows, 'STATUS_THIS_MONTH'].astype(str) == "Unchanged").to_numpy()]
+			table6.loc[unchanged, 'STATUS_THIS_MONTH'] = "Updated"
+			table6.loc[unchanged, 'LAST_UPDATED'] = today
+			table6.loc[rows, 'ACCESSION_TOTAL'] = table6.loc[rows, 'ACCESSION_TOTAL'].astype(int) + 1
+			table6.loc[rows, 'CURRENT_MONTH_INCREASE'] = table6.loc[rows, 'CURRENT_MONTH_INCREASE'].astype(int) + 1
+			table6.loc[rows, 'ACCESSION_LIST'] = [",".join(sorted(accs | {self.accession})) for accs in acc_lists]
+
+		# Add the CTS substitution to the mutation summary of the updated CTS-mut entries.  The summaries
+		# are parsed into Counters, incremented, and written back with a single assignment
+		cts_rows = rows[cts]
+		if len(cts_rows) > 0:
+			mut_sums = [Counter({key: int(val) for key, val in (item.split(":") for item in mut_sum.split(","))})
+				for mut_sum in table6.loc[cts_rows, 'MUTATION_SUM'].astype(str)]
+			for mut_sum, variant in zip(mut_sums, variants[cts]):
+				mut_sum[variant] += 1
+			table6.loc[cts_rows, 'MUTATION_SUM'] = [",".join([key+':'+str(val) for key, val in mut_sum.items()]) for mut_sum in mut_sums]
+
+		# Add all of the new entries with a single concat
+		if not misses.empty:
+			mut_sum = np.where(misses['AUTO_ALIGNMENT_ISSUE'].isin(cts_flags), misses['VARIANT']+':'+str(1), "")
+			table6_profile = pd.DataFrame({'PROFILE_NAME': self.profile, 'STATUS_THIS_MONTH': "New", 'LAST_UPDATED': today, 
+				'FLU_SUBTYPE': self.strain_name, 'AUTO_ALIGNMENT_ISSUE': misses['AUTO_ALIGNMENT_ISSUE'].to_numpy(), 
+				'POS_PROFILE': misses['POS_PROFILE'].to_numpy(), 'MUTATION_SUM': mut_sum, 
+				'ACCESSION_TOTAL': 1, 'CURRENT_MONTH_INCREASE': 1, 'ACCESSION_LIST': self.accession})
+			table6 = pd.concat([table6, table6_profile], axis = 0, ignore_index = True)
 
 		table6 = table6.sort_values(by = ['PROFILE_NAME', 'ACCESSION_TOTAL'], ascending = [True, False]).reset_index(drop=True)
-		table6.to_csv(Table6, sep = '\t', index = False)
+
+		return(table6)
 
 
 	# Return just a table of the deletion flags, if any
@@ -292,39 +348,78 @@ class Curation(object):
 	@staticmethod
 	def get_acc_and_seq(query):
 		
-		for seq_record in SeqIO.parse(query, 'fasta'):
-			metadata = str(seq_record.id)
-			sequence = str(seq_record.seq).strip()
+		for seq_id, seq in MolSeq.read_fasta(query):
+			metadata = seq_id
+			sequence = seq.strip()
 		
-		acc = re.split(r'[^a-zA-Z0-9\s\w-]+', metadata)
-		if re.search(r'[a-zA-Z]+', acc[0]) and re.search(r'[0-9]+', acc[0]):
+		acc = ACCESSION_SPLIT.split(metadata)
+		if HAS_LETTER.search(acc[0]) and HAS_DIGIT.search(acc[0]):
 			accession = acc[0]
 		else:
 			accession = acc[1]
 
 		return(accession, sequence)
 
-	# Meant for parsing the boundary file to know the CTS, NCR, and CDS start and end regions of the profile
+	# Identity of the sequence to the closest of the reference sequences, from an in-process local alignment
+	# (identities over alignment length) rather than a BLAST run.  The closest reference is the one with
+	# the best alignment score.  Sequences are compared in upper case, and a query with no local alignment
+	# scoring above 0 has an identity of 0
+	@staticmethod
+	def reidentity(sequence, reference_seqs):
+
+		sequence = sequence.upper()
+		scores = {}
+		for reference_seq in reference_seqs:
+			reference_seq = reference_seq.upper()
+			if reference_seq not in scores:
+				scores[reference_seq] = IDENTITY_ALIGNER.score(sequence, reference_seq)
+
+		reference_seq = max(scores, key = scores.get, default = None)
+		if reference_seq is None or scores[reference_seq] <= 0:
+			return(0.0)
+		alignment = IDENTITY_ALIGNER.align(sequence, reference_seq)[0]
+
+		return(alignment.counts().identities/alignment.length)
+
+	# Map the strain name of each profile in the profile directory to its file name, [strain]_[date].afa.
+	# The index is built from a single listing, cached for the life of the process, and only rebuilt when
+	# the directory's modification time changes
+	@staticmethod
+	def profile_index(profile_dir):
+
+		return(Curation.profile_index_cached(profile_dir, os.path.getmtime(profile_dir)))
+
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def profile_index_cached(profile_dir, mtime):
+
+		profiles = {}
+		for filename in sorted(os.listdir(profile_dir)):
+			profiles.setdefault(filename.rpartition("_")[0], filename)
+
+		return(profiles)
+
+	# Meant for parsing the boundary file to know the CTS, NCR, and CDS start and end regions of the profile.
+	# Parsed boundaries are cached per strain and boundary file, and re-parsed only if the file is modified
 	@staticmethod
 	def parse_boundary_file(strain_name, boundary_file):
 
 		try:
-			boundary_types = open(boundary_file, 'r').readlines()
+			mtime = os.path.getmtime(boundary_file)
 		except:
 			raise Exception("\nERROR: Invalid boundary_file directory and/or file\n")
-		boundary = ""
-		for line in boundary_types:	
-			if (line.startswith(strain_name)):
-				boundary = line
-				break
-
-		boundary = boundary.split("|")
-		boundary.pop(0)
-		boundaries = {}
-		for coord in boundary:
-			feat = coord.split("=")[0]
-			pos = int(coord.split("=")[1])
-			boundaries[feat] = pos
+
+		return(Curation.parse_boundary_file_cached(strain_name, boundary_file, mtime))
+
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def parse_boundary_file_cached(strain_name, boundary_file, mtime):
+
+		# Boundaries of the first strain that starts with (normally is) the strain name
+		strain_boundaries = Curation.read_boundary_file(boundary_file, mtime)
+		boundaries = strain_boundaries.get(strain_name)
+		if boundaries is None:
+			boundaries = next((strain_boundaries[strain] for strain in strain_boundaries if strain.startswith(strain_name)), {})
 
 		boundary_df = pd.DataFrame({"Region": ["CTS5", "NCR5", "CDS", "NCR3", "CTS3"],
 			"Start": [boundaries['START'], boundaries['CTS5']+1, boundaries['ATG'], boundaries['STOP']+1, boundaries['CTS3']],
@@ -332,16 +427,55 @@ class Curation(object):
 
 		return(boundary_df)
 
+	# Read the whole boundary file once into a dictionary of the feature positions of each strain,
+	# {strain: {'START': x, 'CTS5': y, ...}}, in file order
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def read_boundary_file(boundary_file, mtime):
+
+		try:
+			boundary_types = open(boundary_file, 'r').readlines()
+		except:
+			raise Exception("\nERROR: Invalid boundary_file directory and/or file\n")
+		strain_boundaries = {}
+		for line in boundary_types:
+			if line.startswith("#") or "|" not in line:
+				continue
+			boundary = line.split("|")
+			strain = boundary.pop(0)
+			if strain in strain_boundaries:
+				continue
+			boundaries = {}
+			for coord in boundary:
+				feat = coord.split("=")[0]
+				pos = int(coord.split("=")[1])
+				boundaries[feat] = pos
+			strain_boundaries[strain] = boundaries
+
+		return(strain_boundaries)
+
 	# Meant to parse the lookup table so that we can use information for a specific strain.
+	# Parsed entries are cached per profile and lookup table, and re-parsed only if the file is modified
 	@staticmethod
 	def parse_lookup_table(profile, lookup_table):
 
+		try:
+			mtime = os.path.getmtime(lookup_table)
+		except:
+			raise Exception("\nERROR: Invalid lookup_table directory and/or file\n")
+
+		return(Curation.parse_lookup_table_cached(profile, lookup_table, mtime))
+
+	@staticmethod
+	@lru_cache(maxsize = None)
+	def parse_lookup_table_cached(profile, lookup_table, mtime):
+
 		try:
 			lookup_open = open(lookup_table, 'r', encoding = "ISO-8859-1")
 		except:
 			raise Exception("\nERROR: Invalid lookup_table directory and/or file\n")
 		lookup_allowed = lookup_open.readlines()
-		profile_lookup = []
+		profile_lookup = {}
 		for line in lookup_allowed:	
 			if (line.startswith(profile)):
 				line_attribs = line.split('\t')
@@ -353,21 +487,18 @@ class Curation(object):
 				else:
 					start = int(start_end[0])
 					end = int(start_end[0])
-				lookup_df = pd.DataFrame({'Flag': [flag], 'Start': [start], 'End': [end]})
-				profile_lookup.append(lookup_df)
+				starts, ends = profile_lookup.setdefault(flag, ([], []))
+				starts.append(start)
+				ends.append(end)
 
-		if profile_lookup != []:
-			lookup_df = pd.concat(profile_lookup, ignore_index = True)
-		else:
-			lookup_df = pd.DataFrame({'Flag': ['XXX'], 'Start': [-1], 'End': [-1]})
+		# Allowed (start, end) ranges of each flag as arrays, so a lookup check is a single vectorized comparison
+		lookup = {flag: (np.array(starts), np.array(ends)) for flag, (starts, ends) in profile_lookup.items()}
 
-		return(lookup_df)
+		return(lookup)
 
-	# Save the MUSCLE alignment if there were no insertions
+	# Save the MUSCLE alignment, passed in as a fasta string, if there were no insertions
 	@staticmethod
 	def save_alignment(query_acc, alignment, output_dir):
 
-		with open(alignment, 'r') as file1:
-			with open(output_dir+"/"+query_acc+"_aligned.fasta", 'w') as file2:
-				for line in file1:
-					file2.write(line)
\ No newline at end of file
+		with open(output_dir+"/"+query_acc+"_aligned.fasta", 'w') as file:
+			file.write(alignment)
\ No newline at end of file
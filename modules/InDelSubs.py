@@ -4,15 +4,16 @@
 
 import pandas as pd
 import numpy as np
-from Bio import SeqIO
-from itertools import groupby
-from operator import itemgetter
+from MolSeq import MolSeq, INDETERMINATE_NUCS
 from collections import Counter
 
+# Allowed ranges of a flag that is not in the lookup table
+NO_RANGES = np.array([], dtype=int)
+
 
 class InDelSubs(object):
 
-	# This object just expects the profile alignment in fasta, computed in a separate module.
+	# This object just expects the profile alignment in fasta (a file path or an open handle), computed in a separate module.
 	# This alignment is not assumed to be have preserved length of the original profile because
 	# it needs to identify potential insertions.  Hence, the primary purpose of this init object
 	# is to grab ahold of "non-keep-length" insertions and deletion positions for later computing
@@ -20,102 +21,94 @@ class InDelSubs(object):
 	def __init__(self, alignment):
 
 		# Get all the sequences from the alignment
-		sequences = []
-		for seq_record in SeqIO.parse(alignment, 'fasta'):
-			seq = str(seq_record.seq)
-			sequences.append(seq)
+		sequences = [seq for seq_id, seq in MolSeq.read_fasta(alignment)]
 
 		query_seq = sequences[len(sequences)-1]
 		profile_seqs = sequences[:len(sequences)-1]
 
+		# Byte views of the query and of the profile sequences stacked as a (sequences x columns) matrix,
+		# so gap positions can be found column-wise for the whole profile at once.  Only the matrix of the
+		# profile is kept, the flag methods compare against its columns rather than the profile strings
+		query_arr = np.frombuffer(query_seq.encode('ascii'), dtype=np.uint8)
+		profile_arr = np.frombuffer(''.join(profile_seqs).encode('ascii'), dtype=np.uint8).reshape(len(profile_seqs), -1)
+
 		# Deletion positions, denoted as gaps, within the query sequence.
 		# These positions are with respect to the Non-Keeplength alginment
 		# nkdp = Non-Keeplength Deletion Positions
-		nkdp = set([i for i, ltr in enumerate(query_seq) if ltr == "-"])
-
-		first_seq_dashes = set([i for i, ltr in enumerate(profile_seqs[0]) if ltr == "-"])
-		profile_seqs_minus = profile_seqs[1:len(profile_seqs)]
-
-		profile_dash_union = first_seq_dashes
-		for seq in profile_seqs_minus:
-			seq_dashes = set([i for i, ltr in enumerate(seq) if ltr == "-"])
-			profile_dash_union = profile_dash_union.union(seq_dashes)
+		nkdp = np.flatnonzero(query_arr == ord('-'))
 
-		# Required for computing the insertions positions
-		profile_dash_intsct = first_seq_dashes
-		for seq in profile_seqs_minus:
-			seq_dashes = set([i for i, ltr in enumerate(seq) if ltr == "-"])
-			profile_dash_intsct = profile_dash_intsct.intersection(seq_dashes)
+		# Columns with a gap in any of the profile sequences, and columns that are gaps in all of them.
+		# The latter is required for computing the insertions positions
+		profile_gaps = profile_arr == ord('-')
+		profile_dash_union = np.flatnonzero(profile_gaps.any(axis = 0))
+		profile_dash_intsct = np.flatnonzero(profile_gaps.all(axis = 0))
 
 		# Insertion positions, denoted as gaps conserved accross entire profile but
 		# not in the query.  These positions are with respect to the Non-Keeplength alignment
 		# nkip = Non-Keeplength Insertion Positions
-		nkip = set(profile_dash_intsct - nkdp)
+		nkip = np.setdiff1d(profile_dash_intsct, nkdp)
 
 		# Accepted deletion positions are gaps/dashes that exist in the profile sequences.
 		# These positions are with respect to the Non-Keeplength alignment.
 		# nkadp = Non-Keeplenght Accepted Deletion Positions
-		nkadp = set(profile_dash_union - nkip)
-
-		# Group together non-keep-length sequential deletions as a list of lists
-		del_groups = []
-		flag_dels = list(set(set(nkdp) - set(nkadp)))
-		flag_dels = np.array(flag_dels)
-		flag_dels = np.sort(flag_dels)
-		for k, g in groupby(enumerate(flag_dels), lambda ix: ix[0] - ix[1]):
-			del_groups.append(list(map(itemgetter(1), g)))
-
-		# Group together non-keep-length sequential insertions as a list of lists
-		ins_groups = []
-		nkip = np.array(list(nkip))
-		nkip = np.sort(nkip)
-		for k, g in groupby(enumerate(nkip), lambda ix: ix[0] - ix[1]):
-			ins_groups.append(list(map(itemgetter(1), g)))
+		nkadp = np.setdiff1d(profile_dash_union, nkip)
 
+		# Group together non-keep-length sequential deletions as a list of position arrays
+		flag_dels = np.setdiff1d(nkdp, nkadp)
+		del_groups = self.consecutive_runs(flag_dels)
+
+		# Group together non-keep-length sequential insertions as a list of position arrays
+		ins_groups = self.consecutive_runs(nkip)
+
+		# Positions are kept as sorted numpy arrays rather than sets
 		self.nkdp = nkdp
 		self.nkip = nkip
 		self.nkadp = nkadp
 		self.query_seq = query_seq
-		self.profile_seqs = profile_seqs
+		self.query_arr = query_arr
+		self.profile_arr = profile_arr
 		self.del_groups = del_groups
 		self.ins_groups = ins_groups
 
-	# Reports the flags triggered by deletions. Requires the processed boundary file and
-	# lookup table file as pandas dataframes.
-	def deletion_flags(self, boundary_df, lookup_df):
+	# Reports the flags triggered by deletions. Requires the processed
+	# boundary file as a pandas dataframe and the lookup table as a dictionary of allowed ranges per flag.
+	def deletion_flags(self, boundary_df, lookup):
 
-		# Needed for adjusting profile positions to query positions
-		all_profile_ins = [(j-len([i for i in self.nkip if i <= j]))+1 for j in self.nkip]
-		all_profile_del = [(j-len([i for i in self.nkip if i < j]))+1 for j in self.nkdp]
+		# Needed for adjusting profile positions to query positions. The position arrays are sorted,
+		# so the number of insertions/deletions before a position is a binary search
+		all_profile_ins = self.nkip - np.arange(len(self.nkip))
+		all_profile_del = self.nkdp - np.searchsorted(self.nkip, self.nkdp, side = 'left') + 1
+
+		# Annotated regions as arrays so the regions overlapping each group are found without a pandas filter
+		region_names, region_starts, region_ends = self.region_arrays(boundary_df)
 
 		flags = []
 		for pos in self.del_groups:
 			
 			# Profile and query deletions in the group. profile_del has exact profile positions
 			# but query_del has the positions in the query proceeding deletions event
-			profile_del = [(j-len([i for i in self.nkip if i < j]))+1 for j in pos]
-			query_del = [(j-len([i for i in self.nkdp if i <= j]))+1 for j in pos]
+			profile_del = pos - np.searchsorted(self.nkip, pos, side = 'left') + 1
+			query_del = pos - np.searchsorted(self.nkdp, pos, side = 'right') + 1
 
 			# This will get ALL regions for which the deletion gaps may be overlapping
-			regions = boundary_df[(boundary_df['Start'] <= profile_del[len(profile_del)-1]) & (boundary_df['End'] >= profile_del[0])]
-			regions = regions.to_dict('records')
+			regions = np.flatnonzero((region_starts <= profile_del[len(profile_del)-1]) & (region_ends >= profile_del[0]))
 			
 			# Loop through all possible regions for which gaps may be overlapping
 			for reg in regions:
-				region = reg['Region']
+				region = region_names[reg]
 				
 				# Annotated region start end with respect to profile
-				start_p = reg['Start']
-				end_p = reg['End']
+				start_p = region_starts[reg]
+				end_p = region_ends[reg]
 				
 				# Annotated region start end with respect to query
 				# Take into account insertions and deletions occuring before the profile position
-				start_q = start_p + len([i for i in all_profile_ins if i < start_p]) - len([j for j in all_profile_del if j <= start_p])
-				end_q = end_p + len([i for i in all_profile_ins if i < end_p]) - len([j for j in all_profile_del if j <= end_p])
+				start_q = start_p + np.searchsorted(all_profile_ins, start_p, side = 'left') - np.searchsorted(all_profile_del, start_p, side = 'right')
+				end_q = end_p + np.searchsorted(all_profile_ins, end_p, side = 'left') - np.searchsorted(all_profile_del, end_p, side = 'right')
 
 				# Positions of deletions in the annotated region with respect to profile and query
-				region_dels_p = [i for i in profile_del if start_p <= i <= end_p]
-				region_dels_q = [i for i in query_del if start_q <= i <= end_q]
+				region_dels_p = profile_del[(profile_del >= start_p) & (profile_del <= end_p)]
+				region_dels_q = query_del[(query_del >= start_q) & (query_del <= end_q)]
 
 				# This will not allow flagging of sequences that are simply shorter;
 				# ie, gaps at the beginning or end of sequence relative to profile
@@ -134,17 +127,17 @@ class InDelSubs(object):
 				elif (region == 'CTS3'):
 					flags.append(tuple(("3'CTS-del", profile_pos, query_pos, "del", len(region_dels_p))))
 				elif (region == 'NCR5'):
-					if self.check_lookup(lookup_df, "5'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+					if self.check_lookup(lookup, "5'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 						flags.append(tuple(("5'NCR-del", profile_pos, query_pos, "del", len(region_dels_p))))
 				elif (region == 'NCR3'):
-					if self.check_lookup(lookup_df, "3'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+					if self.check_lookup(lookup, "3'NCR-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 						flags.append(tuple(("3'NCR-del", profile_pos, query_pos, "del", len(region_dels_p))))
 				elif (region == 'CDS'):
 					if (len(pos) % 3) == 0:
-						if self.check_lookup(lookup_df, "CDS-3Xdel", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+						if self.check_lookup(lookup, "CDS-3Xdel", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 							flags.append(tuple(("CDS-3Xdel", profile_pos, query_pos, "del", len(region_dels_p))))
 					else:
-						if self.check_lookup(lookup_df, "CDS-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
+						if self.check_lookup(lookup, "CDS-del", region_dels_p[0], region_dels_p[len(region_dels_p)-1]) == "FAIL":
 							flags.append(tuple(("CDS-del", profile_pos, query_pos, "del", len(region_dels_p))))
 
 		return flags
@@ -153,14 +146,15 @@ class InDelSubs(object):
 	def insertion_flags(self, boundary_df):
 
 		profile_length = boundary_df['End'][4]
+		region_names, region_starts, region_ends = self.region_arrays(boundary_df)
 
 		flags = []
 		for pos in self.ins_groups:
 
 			ins_muts = self.query_seq[pos[0]:pos[len(pos)-1]+1].upper()
 
-			profile_ins = [(j-len([i for i in self.nkip if i <= j]))+1 for j in pos]
-			query_ins = [(j-len([i for i in self.nkdp if i < j]))+1 for j in pos]
+			profile_ins = pos - np.searchsorted(self.nkip, pos, side = 'right') + 1
+			query_ins = pos - np.searchsorted(self.nkdp, pos, side = 'left') + 1
 
 			if len(pos) > 1:
 				query_pos = str(query_ins[0])+".."+str(query_ins[len(query_ins)-1])
@@ -176,8 +170,7 @@ class InDelSubs(object):
 				flags.append(tuple(("3'NCR-ext", profile_pos, query_pos, ins_muts, len(pos))))
 				continue
 
-			region = boundary_df[(boundary_df['Start'] <= profile_ins[len(profile_ins)-1]) & (boundary_df['End'] >= profile_ins[0])]
-			region = list(region['Region'])[0]
+			region = region_names[(region_starts <= profile_ins[len(profile_ins)-1]) & (region_ends >= profile_ins[0])][0]
 
 			# Go through each of the possible flags
 			if (region == 'CTS5'):
@@ -215,23 +208,20 @@ class InDelSubs(object):
 		CTS5_end_adj = CTS5_end + sum([len(self.ins_groups[i]) for i in range(len(self.ins_groups)) if self.ins_groups[i][0] < CTS5_end])
 		CTS3_end_adj = CTS3_end + sum([len(self.ins_groups[i]) for i in range(len(self.ins_groups)) if self.ins_groups[i][0] < CTS3_end])
 
-		# Get the CTS regions of the query sequence
-		CTS5_query = self.query_seq[CTS5_start_adj:CTS5_end_adj+1]
-		CTS3_query = self.query_seq[CTS3_start_adj:CTS3_end_adj+1]
-
-		cts5_muts = [i for i in range(len(CTS5_query)) if CTS5_query[i] not in [seq[CTS5_start_adj:CTS5_end_adj+1][i]
-			for seq in self.profile_seqs] and not ((i in self.nkip) or (i in self.nkdp))]
+		# A CTS position is a substitution if the query character matches none of the profile sequences
+		# in that column, unless the column is an insertion or deletion
+		indel_positions = np.union1d(self.nkip, self.nkdp)
 
-		cts3_muts = [i+CTS3_start_adj for i in range(len(CTS3_query)) if CTS3_query[i] not in [seq[CTS3_start_adj:CTS3_end_adj+1][i] 
-			for seq in self.profile_seqs] and not ((i+CTS3_start_adj in self.nkip) or (i+CTS3_start_adj in self.nkdp))]
+		cts5_match = (self.profile_arr[:, CTS5_start_adj:CTS5_end_adj+1] == self.query_arr[CTS5_start_adj:CTS5_end_adj+1]).any(axis = 0)
+		cts5_cols = CTS5_start_adj + np.arange(len(cts5_match))
+		cts5_muts = cts5_cols[~cts5_match & ~np.isin(cts5_cols, indel_positions)]
 
-		cts5_positions = []
-		for k, g in groupby(enumerate(cts5_muts), lambda ix: ix[0] - ix[1]):
-			cts5_positions.append(list(map(itemgetter(1), g)))
+		cts3_match = (self.profile_arr[:, CTS3_start_adj:CTS3_end_adj+1] == self.query_arr[CTS3_start_adj:CTS3_end_adj+1]).any(axis = 0)
+		cts3_cols = CTS3_start_adj + np.arange(len(cts3_match))
+		cts3_muts = cts3_cols[~cts3_match & ~np.isin(cts3_cols, indel_positions)]
 
-		cts3_positions = []
-		for k, g in groupby(enumerate(cts3_muts), lambda ix: ix[0] - ix[1]):
-			cts3_positions.append(list(map(itemgetter(1), g)))
+		cts5_positions = self.consecutive_runs(cts5_muts)
+		cts3_positions = self.consecutive_runs(cts3_muts)
 
 		flags = []
 
@@ -239,10 +229,10 @@ class InDelSubs(object):
 		for pos in cts5_positions:
 			subs = self.query_seq[pos[0]:pos[len(pos)-1]+1].upper()
 			# Check if the current substituions are just N characters, continue loop if so and do not flag
-			if len(set(list(subs))) == 1 and list(set(list(subs)))[0] == 'N':
+			if np.isin(self.query_arr[pos], INDETERMINATE_NUCS).all():
 				continue
-			profile_sub = [(j-len([i for i in self.nkip if i < j]))+1 for j in pos]
-			query_sub = [(j-len([i for i in self.nkdp if i < j]))+1 for j in pos]
+			profile_sub = pos - np.searchsorted(self.nkip, pos, side = 'left') + 1
+			query_sub = pos - np.searchsorted(self.nkdp, pos, side = 'left') + 1
 
 			if len(pos) > 1:
 				profile_pos = str(profile_sub[0])+".."+str(profile_sub[len(profile_sub)-1])
@@ -256,10 +246,10 @@ class InDelSubs(object):
 		#Check for 3'CTS mutations:
 		for pos in cts3_positions:
 			subs = self.query_seq[pos[0]:pos[len(pos)-1]+1].upper()
-			if len(set(list(subs))) == 1 and list(set(list(subs)))[0] == 'N':
+			if np.isin(self.query_arr[pos], INDETERMINATE_NUCS).all():
 				continue
-			profile_sub = [(j-len([i for i in self.nkip if i < j]))+1 for j in pos]
-			query_sub = [(j-len([i for i in self.nkdp if i < j]))+1 for j in pos]
+			profile_sub = pos - np.searchsorted(self.nkip, pos, side = 'left') + 1
+			query_sub = pos - np.searchsorted(self.nkdp, pos, side = 'left') + 1
 
 			if len(pos) > 1:
 				profile_pos = str(profile_sub[0])+".."+str(profile_sub[len(profile_sub)-1])
@@ -272,13 +262,28 @@ class InDelSubs(object):
 
 		return flags
 
+	# The region names, start positions, and end positions of the boundary dataframe as arrays
+	@staticmethod
+	def region_arrays(boundary_df):
+
+		return(boundary_df['Region'].to_numpy(), boundary_df['Start'].to_numpy(), boundary_df['End'].to_numpy())
+
+	# Split a sorted array of positions into runs of consecutive positions
+	@staticmethod
+	def consecutive_runs(positions):
+
+		if len(positions) == 0:
+			return([])
+
+		return(np.split(positions, np.flatnonzero(np.diff(positions) != 1) + 1))
+
 	# Check the lookup table to determine if the flag gets accepted.
 	@staticmethod
-	def check_lookup(lookup_df, flag, start, end):
+	def check_lookup(lookup, flag, start, end):
 
-		table = lookup_df[(lookup_df['Flag'] == flag) & (lookup_df['Start'] <= start) & (lookup_df['End'] >= end)]
+		starts, ends = lookup.get(flag, (NO_RANGES, NO_RANGES))
 
-		if len(table) > 0:
+		if np.any((starts <= start) & (ends >= end)):
 			return("PASS")
 		else:
 			return("FAIL")
\ No newline at end of file
@@ -2,6 +2,14 @@
 # query sequence, identify ambiguity in a sequence (indeterminate nucleotides or irregular characters), and write sequences
 # back to a fasta
 
+import numpy as np
+
+
+# Byte codes of the regular (ACGT) and indeterminate (N) nucleotides, in both cases
+REGULAR_NUCS = np.frombuffer(b'ACGTacgt', dtype=np.uint8)
+INDETERMINATE_NUCS = np.frombuffer(b'Nn', dtype=np.uint8)
+
+
 class MolSeq(object):
 
     # This object expects some the accession number of a sequence and the nucleotide sequence as a string of NAs.
@@ -11,6 +19,11 @@ class MolSeq(object):
         self.seq_id = str(accession).strip()
         self.seq = str(sequence).strip()
 
+        # Byte view of the sequence and its character histogram, so every count below is a single lookup
+        # instead of another pass over the sequence
+        self._arr = np.frombuffer(self.seq.encode('ascii', 'replace'), dtype=np.uint8)
+        self._counts = np.bincount(self._arr, minlength=256)
+
     def get_seq_id(self):
         
         return self.seq_id
@@ -29,21 +42,41 @@ class MolSeq(object):
 
     def to_fasta(self):
         
-        return ">{}\n{}".format(self.get_seq_id(), self.get_seq())
+        return ">{}\n{}".format(self.seq_id, self.seq)
+
+    # Iterate over the (ID, sequence) records of a fasta file, given as a path or an open handle.  This is a
+    # lightweight stand-in for SeqIO.parse when only the ID and the sequence string are needed
+    @staticmethod
+    def read_fasta(fasta):
+
+        handle = open(fasta) if isinstance(fasta, str) else fasta
+        try:
+            seq_id = None
+            lines = []
+            for line in handle:
+                if line.startswith('>'):
+                    if seq_id is not None:
+                        yield seq_id, ''.join(lines).replace(' ', '')
+                    title = line[1:].strip()
+                    seq_id = title.split(None, 1)[0] if title else ''
+                    lines = []
+                else:
+                    lines.append(line.strip())
+            if seq_id is not None:
+                yield seq_id, ''.join(lines).replace(' ', '')
+        finally:
+            if handle is not fasta:
+                handle.close()
 
     # Counting the regular nucleotides of the nucelic acid sequence
     def count_regular_nucs(self):
         
-        a = self.get_seq().count('a') + self.get_seq().count('A')
-        c = self.get_seq().count('c') + self.get_seq().count('C')
-        g = self.get_seq().count('g') + self.get_seq().count('G')
-        t = self.get_seq().count('t') + self.get_seq().count('T')
-        return a + c + g + t
+        return int(self._counts[REGULAR_NUCS].sum())
 
     # Count the indeterminate, N's, of the NA sequence
     def count_indeterminate_nucs(self):
         
-        return self.get_seq().count('n') + self.get_seq().count('N')
+        return int(self._counts[INDETERMINATE_NUCS].sum())
 
     # Return the percentage of Ns in the sequence
     def get_n_content(self):
@@ -1,16 +1,54 @@
 # Main program for running the whole script from commandline
 
+import io
+import os
 import sys
 import time
 import argparse
-from Bio import SeqIO
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from Blast import Blast
 from Curation import Curation
 from MolSeq import MolSeq
 
 
+# Curate a single query, given as a fasta string, returning the Curation object, its formatted report, and the
+# compute time for the sequence.  Kept at module level so that it can be run in pool worker processes.  A Blast
+# object from an earlier batch BLAST of the query can be passed in so that the query is not BLASTed again.
+# reports are the (label, Curation method) flag reports to include after the accession and subtype, laid out
+# by template (see report_template)
+def curate_one(query_fasta, blast = None, reports = (), template = None):
+
+	start = time.time()
+	cur = Curation(io.StringIO(query_fasta), blast = blast)
+	end = time.time()
+
+	# The report, flag tables included, is formatted here so that the formatting is spread across the workers
+	if template is None:
+		template = report_template(reports)
+	output = template.format(cur.get_accession(), cur.get_strain(), *[report(cur) for label, report in reports])
+
+	return(cur, output, round(end - start, 3))
+
+# The format string of a record's report for the given flag reports: the accession and subtype, then each
+# report under its label.  Built once per run, since the reports only depend on the --flag option
+def report_template(reports):
+
+	return("Accession: {}\nSubtype: {}\n" + "".join([label+" {}\n" for label, report in reports]) + "\n\n")
+
+# argparse type for a count that must be at least 1, such as the number of processes
+def positive_int(value):
+
+	number = int(value)
+	if number < 1:
+		raise argparse.ArgumentTypeError("must be at least 1, got "+value)
+
+	return(number)
+
 # Required argument: --query [QUERY FASTA]
 # Optional argument: --flag [muts/ambig/ins/del/sub] (ie, the type of flags to return)
 # Optional argument: --table6 [TABLE6 FILE PATH]
+# Optional argument: --processes [NUMBER OF PROCESSES] (ie, how many sequences to curate in parallel)
 if __name__ == "__main__":
 
 	parser = argparse.ArgumentParser()
@@ -19,63 +57,43 @@ if __name__ == "__main__":
 	parser.add_argument('--query', dest = 'query', type = str)
 	
 	# Optional arguments
-	parser.add_argument('--flag', dest = 'flag', type = str)
+	parser.add_argument('--flag', dest = 'flag', type = str, choices = ['mut', 'ambig', 'ins', 'del', 'sub'])
 	parser.add_argument('--table6', dest = 'table6', type = str)
+	parser.add_argument('--processes', dest = 'processes', type = positive_int, default = os.cpu_count() or 1)
 	args = parser.parse_args()
 
 	if (not args.query):
 		sys.exit("\nERROR: No query sequence input\n")
-	if (args.flag and (args.flag != 'mut' and args.flag != 'ambig' and args.flag != 'ins' and args.flag != 'del' and args.flag != 'sub')):
-		sys.exit("\nERROR: Invalid flag argument\n --flag [all/ambig/ins/del/sub]\n")
 	if (args.table6):
 		table6 = args.table6
 	else:
 		table6 = 'outputs/Table6_Jan2019Release.txt'
 
-	for seq_record in SeqIO.parse(args.query, 'fasta'):
-		seq_id = str(seq_record.id)
-		seq = str(seq_record.seq)
-		seq_fasta = MolSeq(seq_id, seq).to_fasta()
-		with open('query.fasta', 'w') as f:	f.write(seq_fasta)
-		start = time.time()
-		cur = Curation('query.fasta')
-		if not args.flag:
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Summary Flag:", cur.summary_flag())
-			print("Ambiguity Flags:", cur.ambiguity_flags())
-			print("Mutation Flags:\n", cur.mutation_flags())
-			print('\n')
-		elif args.flag == 'mut':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Mutation Flags:\n", cur.mutation_flags())
-			print('\n')
-		elif args.flag == 'ambig':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Summary Flag:", cur.summary_flag())
-			print("Ambiguity Flags:", cur.ambiguity_flags())
-			print('\n')
-		elif args.flag == 'ins':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Summary Flag:", cur.summary_flag())
-			print("Insertion Flags:\n", cur.insertion_flags())
-			print('\n')
-		elif args.flag == 'del':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Summary Flag:", cur.summary_flag())
-			print("Deletion Flags:\n", cur.deletion_flags())
-			print('\n')
-		elif args.flag == 'sub':
-			print("Accession:", cur.get_accession())
-			print("Subtype:", cur.get_strain())
-			print("Summary Flag:", cur.summary_flag())
-			print("Substitution Flags:\n", cur.substitution_flags())
-			print('\n')
-		cur.update_table6(Table6 = table6)
-		end = time.time()
-		print("Compute time for sequence:", round(end - start, 3))
-		print('\n')
\ No newline at end of file
+	# Split the query into a fasta string per record so that the records can be curated in parallel.  The
+	# records are read as plain strings, so no SeqRecord or MolSeq is built just to write them back out,
+	# and they are passed along in memory rather than through a query file per record
+	queries = [">"+seq_id+"\n"+seq for seq_id, seq in MolSeq.read_fasta(args.query)]
+
+	# The flag reports printed for every record, after its accession and subtype, for each --flag option
+	summary = ("Summary Flag:", Curation.summary_flag)
+	flag_reports = {None: [summary, ("Ambiguity Flags:", Curation.ambiguity_flags), ("Mutation Flags:\n", Curation.mutation_flags)],
+		'mut': [("Mutation Flags:\n", Curation.mutation_flags)],
+		'ambig': [summary, ("Ambiguity Flags:", Curation.ambiguity_flags)],
+		'ins': [summary, ("Insertion Flags:\n", Curation.insertion_flags)],
+		'del': [summary, ("Deletion Flags:\n", Curation.deletion_flags)],
+		'sub': [summary, ("Substitution Flags:\n", Curation.substitution_flags)]}
+	reports = flag_reports[args.flag]
+	template = report_template(reports)
+
+	# BLAST all of the records in a single run, then curate the records across worker processes.  Results
+	# come back in input order, and Table 6 is only ever updated from this process.  Table 6 is read once,
+	# updated in memory for each record, and written back once at the end (or if curation stops early)
+	blasts = Blast.batch([io.StringIO(query) for query in queries], num_threads = args.processes) if queries else []
+	table6_df = Curation.read_table6(table6)
+	try:
+		with ProcessPoolExecutor(max_workers = args.processes) as executor:
+			for cur, output, compute_time in executor.map(partial(curate_one, reports = reports, template = template), queries, blasts, chunksize = 8):
+				table6_df = cur.add_to_table6(table6_df)
+				sys.stdout.write(output+"Compute time for sequence: "+str(compute_time)+"\n\n\n")
+	finally:
+		Curation.write_table6(table6_df, table6)
@@ -0,0 +1,47 @@
+# Shared setup for the tests.  The modules import each other by module name, so the modules directory is put
+# on the path, and the tests run from the repository root, where the default profile and blast paths resolve
+
+import os
+import sys
+import subprocess
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'modules'))
+
+from MolSeq import MolSeq
+
+QUERY_FASTA = os.path.join(REPO_DIR, 'test_files', 'bv-brc_test_15.fasta')
+PROFILE = os.path.join(REPO_DIR, 'profiles', 'A_5_20181015.afa')
+
+
+@pytest.fixture(autouse = True)
+def repo_dir(monkeypatch):
+
+	monkeypatch.chdir(REPO_DIR)
+
+
+# The first record of the test file, a lowercase H3N2 NP (segment 5) sequence, as a fasta string
+@pytest.fixture
+def lowercase_query():
+
+	seq_id, seq = next(MolSeq.read_fasta(QUERY_FASTA))
+
+	return(">"+seq_id+"\n"+seq+"\n")
+
+
+# The ungapped sequences of the A_5 profile
+@pytest.fixture
+def profile_seqs():
+
+	return([seq.replace("-", "").replace("~", "") for seq_id, seq in MolSeq.read_fasta(PROFILE)])
+
+
+# Skip a test that runs the bundled MUSCLE binary where it does not run on this platform
+@pytest.fixture
+def muscle():
+
+	try:
+		subprocess.run(['./muscle', '-version'], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+	except OSError:
+		pytest.skip("MUSCLE binary does not run on this platform")
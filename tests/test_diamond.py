@@ -0,0 +1,62 @@
+# Tests for the DIAMOND profile lookup, where a hit only picks the profile and the nucleotide identity is
+# computed in process afterwards
+
+import io
+import sys
+import math
+import pytest
+from Blast import Blast
+from Curation import Curation
+
+# Stand-in for DIAMOND blastx that reports the A_5 profile as the top hit of every query
+FAKE_DIAMOND = """#!{python}
+import sys
+args = sys.argv[1:]
+query, out = args[args.index('--query')+1], args[args.index('-o')+1]
+with open(query) as query_handle, open(out, 'w') as out_handle:
+	for line in query_handle:
+		if line.startswith('>'):
+			out_handle.write(line[1:].split()[0]+'\\tSEQ|A_5_20181015.afa\\n')
+"""
+
+
+@pytest.fixture
+def fake_diamond(tmp_path):
+
+	diamond_cmd = tmp_path / 'diamond'
+	diamond_cmd.write_text(FAKE_DIAMOND.format(python = sys.executable))
+	diamond_cmd.chmod(0o755)
+	diamond_db = tmp_path / 'flu_profiles_db.dmnd'
+	diamond_db.touch()
+
+	return(str(diamond_cmd), str(diamond_db))
+
+
+def test_diamond_hit_has_no_identity(fake_diamond, lowercase_query, profile_seqs):
+
+	diamond_cmd, diamond_db = fake_diamond
+	b = Blast(io.StringIO(lowercase_query), diamond_db = diamond_db, diamond_cmd = diamond_cmd)
+	assert b.get_profile() == 'A_5_20181015.afa'
+	assert math.isnan(b.get_identity())
+
+	sequence = lowercase_query.split("\n")[1]
+	assert Curation.reidentity(sequence, profile_seqs) > 0.95
+
+
+def test_diamond_batch_lowercase_queries(fake_diamond, lowercase_query):
+
+	diamond_cmd, diamond_db = fake_diamond
+	queries = [io.StringIO(lowercase_query), io.StringIO(lowercase_query.upper())]
+	blasts = Blast.batch(queries, diamond_db = diamond_db, diamond_cmd = diamond_cmd, num_threads = 1)
+	assert [b.get_profile() for b in blasts] == ['A_5_20181015.afa', 'A_5_20181015.afa']
+	assert all(math.isnan(b.get_identity()) for b in blasts)
+
+
+def test_diamond_curation_lowercase_query(fake_diamond, lowercase_query, muscle, tmp_path):
+
+	diamond_cmd, diamond_db = fake_diamond
+	b = Blast(io.StringIO(lowercase_query), diamond_db = diamond_db, diamond_cmd = diamond_cmd)
+
+	cur = Curation(io.StringIO(lowercase_query), blast = b, output_dir = str(tmp_path))
+	assert cur.get_profile() == 'A_5_20181015.afa'
+	assert 'Excess-Dist' not in cur.ambiguity_flags()
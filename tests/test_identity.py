@@ -0,0 +1,30 @@
+# Tests for the in-process identity of a query to a profile, used when the profile is known without a
+# nucleotide BLAST identity
+
+from Curation import Curation
+
+
+def test_reidentity_ignores_case(lowercase_query, profile_seqs):
+
+	sequence = lowercase_query.split("\n")[1]
+	assert sequence.islower()
+
+	identity = Curation.reidentity(sequence, profile_seqs)
+	assert identity == Curation.reidentity(sequence.upper(), profile_seqs)
+	assert identity > 0.95
+
+
+def test_reidentity_without_alignment():
+
+	assert Curation.reidentity("NNNN", ["ACGT"]) == 0.0
+	assert Curation.reidentity("ACGT", []) == 0.0
+
+
+def test_strain_name_lowercase_query(lowercase_query, muscle, tmp_path):
+
+	query_file = tmp_path / 'query.fasta'
+	query_file.write_text(lowercase_query)
+
+	cur = Curation(str(query_file), strain_name = 'A_5', output_dir = str(tmp_path))
+	assert cur.get_profile() == 'A_5_20181015.afa'
+	assert 'Excess-Dist' not in cur.ambiguity_flags()
@@ -0,0 +1,18 @@
+# Tests for the command line options of the main program
+
+import argparse
+import pytest
+from main import positive_int
+
+
+def test_positive_int():
+
+	assert positive_int("1") == 1
+	assert positive_int("8") == 8
+
+
+@pytest.mark.parametrize("value", ["0", "-2"])
+def test_positive_int_rejects_below_one(value):
+
+	with pytest.raises(argparse.ArgumentTypeError):
+		positive_int(value)